@@ -1,11 +1,11 @@
 from dataclasses import dataclass, field
 import time
-from typing import List, Tuple, Optional, NamedTuple
+from typing import List, Optional, NamedTuple
 
 import pygame
 
 from commonui import *
-from hvm import MemOp, Term, Interaction
+from hvm import MemOp, Tag, Term, Interaction, access_key
 from refui import * #RefManager, RefRect
 from fonts import fonts
 from text_cache import TextCache
@@ -96,6 +96,10 @@ class AnimState:
     alpha: float = 255
     color: Optional[Color] = None
     start_time: float = field(default_factory=time.monotonic)
+    # area and color it was last drawn with
+    drawn: Optional[tuple[Optional[pygame.Rect], Color]] = None
+    # access_key of the memop whose put term this anim lands, if any
+    access: int = 0
     #subs: list['AnimState'] = field(default_factory=list)
     #in_flight: bool = False
 
@@ -186,13 +190,17 @@ def ease_in_out_cubic(t: float) -> float:
     else:
         return 1 - pow(-2 * t + 2, 3) / 2
 
+# channels of interpolated colors are rounded to this, so fades reuse a few
+# rendered colors instead of each frame rendering its own
+COLOR_STEP = 8
+
 def interpolate_color(color1: Color, color2: Color, t: float) -> Color:
     color = (
         int(color1[0] + (color2[0] - color1[0]) * t),
         int(color1[1] + (color2[1] - color1[1]) * t),
         int(color1[2] + (color2[2] - color1[2]) * t)
     )
-    return tuple(max(0, min(255, x)) for x in color)
+    return tuple(max(0, min(255, round(x / COLOR_STEP) * COLOR_STEP)) for x in color)
 
 class AnimManager:
     def __init__(self, screen: pygame.Surface, ref_mgr: RefManager, table: dict, text_cache: TextCache):
@@ -304,6 +312,8 @@ class AnimManager:
                 to_nod = anim.to_rect.get_node_term(anim.to_loc).node
                 to_nod.set(anim.to_loc, anim.nod_trm)
                 anim.to_rect = None
+                # the memop is done once its put term lands
+                self.ref_mgr.cursor = max(self.ref_mgr.cursor, anim.access)
                 """
                 next_anim = anim.notify()
                 if next_anim:
@@ -319,10 +329,8 @@ class AnimManager:
         # Animation continues
         return False
 
-    def draw(self, surface: pygame.Surface, anim: AnimState, font: pygame.font.Font):
-        if anim.phase == len(anim.phases):
-            return
-
+    # each field of the term (TAG, LAB, LOC) and where it's drawn
+    def fields(self, anim: AnimState) -> list[tuple[str, Position]]:
         # TODO: dumb to calculate this every time, they don't change
         col_positions = []
         pos_x = 0
@@ -334,35 +342,38 @@ class AnimManager:
                     self.table['col_spacing_by_index'][i + 1]
                 )
 
-        # Draw each field of the term (TAG, LAB, LOC)
         term = anim.nod_trm
         term_data = (
-            term.tag[:3],
+            str(term.tag),
             f"{term.lab:03d}",
             f"{term.loc:03d}"
         )
         offset = ui.scroll_mgr.offset
         pos = Position(anim.cur_pos.x + offset, anim.cur_pos.y)
-        for i, (value, col_x) in enumerate(zip(term_data, col_positions)):
-            if anim.color in (DIM_GREEN, BRIGHT_GREEN, ORANGE, BRIGHT_ORANGE):
-                # Use cache for standard colors
-                rndr_txt = self.text_cache.get_rendered_text(value)
-
-                if anim.color in (BRIGHT_GREEN, BRIGHT_ORANGE):
-                    if not rndr_txt.brt.surface or rndr_txt.brt.color != anim.color:
-                        rndr_txt.brt.surface = font.render(value, True, anim.color)
-                        rndr_txt.brt.color = anim.color
-                    txt_surf = rndr_txt.brt.surface
-                else:
-                    if not rndr_txt.dim.surface or rndr_txt.dim.color != anim.color:
-                        rndr_txt.dim.surface = font.render(value, True, anim.color)
-                        rndr_txt.dim.color = anim.color
-                    txt_surf = rndr_txt.dim.surface
-            else:
-                # Render directly for interpolated colors
-                txt_surf = font.render(value, True, anim.color)
-            
-            surface.blit(txt_surf, (pos.x + col_x, pos.y))
+        return [(value, Position(pos.x + col_x, pos.y)) for value, col_x in zip(term_data, col_positions)]
+
+    def area(self, anim: AnimState, font: pygame.font.Font) -> Optional[pygame.Rect]:
+        if anim.phase == len(anim.phases):
+            return None
+        rects = [pygame.Rect(pos, (self.text_cache.width(font, value, anim.color), font.get_height()))
+                 for value, pos in self.fields(anim)]
+        return rects[0].unionall(rects[1:])
+
+    # mark where anim was drawn and where it will be, if it changed
+    def mark_dirty(self, anim: AnimState):
+        drawn = (self.area(anim, fonts.content), anim.color)
+        if drawn == anim.drawn: return
+        for area in (anim.drawn[0] if anim.drawn else None, drawn[0]):
+            if area:
+                ui.dirty.add(area)
+        anim.drawn = drawn
+
+    def draw(self, surface: pygame.Surface, anim: AnimState, font: pygame.font.Font):
+        if anim.phase == len(anim.phases):
+            return
+        for value, pos in self.fields(anim):
+            # interpolated colors are cached too; the LRU evicts them
+            self.text_cache.draw(surface, font, value, pos, anim.color)
 
     def slide_out(self, memop: MemOp, rect: Optional[RefRect]) -> Optional[AnimState]:
         term = memop.got
@@ -377,7 +388,7 @@ class AnimManager:
         y = term_y_pos(rect, memop.loc, self.table)
         if y is None: return None
 
-        last_phase = 'fade_out' if term.tag == 'SUB' else 'wait'
+        last_phase = 'fade_out' if term.tag == Tag.SUB else 'wait'
         phases = ['fade_in', 'slide_out', last_phase]
         anim = AnimState(nod_trm.copy(), memop.itr, Position(x, y),
                          Phase.make_list(*phases), from_rect = rect,
@@ -412,7 +423,7 @@ class AnimManager:
         self.add(anim)
         return anim
 
-    def move(self, anim: AnimState, rect: RefRect, loc: int):
+    def move(self, anim: AnimState, rect: RefRect, loc: int, access: int):
         final_x = term_x_pos(rect, self.table)
         final_y = term_y_pos(rect, loc, self.table)
 
@@ -429,6 +440,7 @@ class AnimManager:
         Phase.append(anim.phases, 'slide_in', 'fade_out')
         anim.to_rect = rect
         anim.to_loc = loc
+        anim.access = access
         """
         if loc in self.loc_map:
             active = self.loc_map[loc]
@@ -464,6 +476,7 @@ class AnimManager:
             # update the dst node state now if the dst ref isn't visible
             dst_nod_trm = memop.node.get(memop.loc)
             dst_nod_trm.set(memop.put)
+            self.ref_mgr.cursor = access_key(memop.itr.idx, memop.idx)
 
         if put_anim is None:
             # don't bother manifesting 'emergent' terms that slide to nowhere
@@ -476,7 +489,7 @@ class AnimManager:
         if to_rect is None:
             Phase.append(put_anim.phases, 'slide_to_top', 'fade_out')
         else:
-            self.move(put_anim, to_rect, memop.loc)
+            self.move(put_anim, to_rect, memop.loc, access_key(memop.itr.idx, memop.idx))
 
     def animate(self, memop: MemOp):
         if memop.is_take():
@@ -489,6 +502,9 @@ class AnimManager:
     def remove_waiting(self) -> list[NodeTerm]:
         rmvd = [anim.nod_trm for anim in self.anims]
         #if not anim.on_last_phase() or not anim.waiting()]
+        for anim in self.anims:
+            if anim.drawn and anim.drawn[0]:
+                ui.dirty.add(anim.drawn[0])
         self.anims = []
         return rmvd
 
@@ -500,6 +516,7 @@ class AnimManager:
                 anims.append(anim)
                 if not anim.waiting():
                     all_waiting = False
+            self.mark_dirty(anim)
         self.anims = anims
         self.ready = all_waiting
 
@@ -0,0 +1,199 @@
+from array import array
+import hashlib
+import os
+import pickle
+import sys
+from typing import Optional
+
+from hvm import *
+
+# On-disk cache of a fully linked Model, so re-opening an unchanged memlog
+# skips parsing and linking entirely.
+#
+# The cache is valid if it was written by the same CACHE_VERSION and the
+# memlog has the same size and either the same mtime or, if the mtime has
+# changed, the same content hash.
+#
+# The model's object graph is deep (redex -> psh_itr -> redex -> ...) so it
+# is flattened to index-based tuples before pickling, and rebuilt on load.
+
+CACHE_EXT = '.hvmc'
+# bump whenever the parser or the model classes change what make_all builds
+CACHE_VERSION = 5
+
+def cache_path(filename: str, cache_dir: Optional[str] = None) -> str:
+    if not cache_dir:
+        return filename + CACHE_EXT
+    name = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+    return os.path.join(cache_dir, name + CACHE_EXT)
+
+def file_hash(filename: str) -> str:
+    digest = hashlib.blake2b()
+    with open(filename, 'rb') as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+def flat_term(term: Optional[Term]) -> Optional[tuple[int, int, int]]:
+    return (int(term.tag), term.lab, term.loc) if term else None
+
+def make_term(flat: Optional[tuple[int, int, int]]) -> Optional[Term]:
+    return Term(TAG_LIST[flat[0]], flat[1], flat[2]) if flat else None
+
+def flat_node(node: Optional[Node]) -> Optional[tuple[int, int]]:
+    return (node.ref.idx, node.idx) if node else None
+
+# Flattens interactions and the redexes they refer to. row_base is added to
+# every memop index, for interactions linked over a slice of the table.
+def flatten_itrs(itrs: list[Interaction], redexes: list[Redex],
+                 row_base: int = 0) -> tuple[list, list]:
+    redex_ids = {id(redex): i for i, redex in enumerate(redexes)}
+
+    def redex_id(redex: Optional[Redex]) -> int:
+        return redex_ids[id(redex)] if redex else -1
+
+    def rows(idxs: array) -> array:
+        return array('I', [idx + row_base for idx in idxs]) if row_base else idxs
+
+    flat_redexes = [
+        (r.seq, r.tid, itr_str(r.itr_name), r.loc,
+         flat_term(r.neg.term), flat_node(r.neg.node),
+         flat_term(r.pos.term), flat_node(r.pos.node),
+         r.psh_itr.idx if r.psh_itr else -1)
+        for r in redexes
+    ]
+    flat_itrs = []
+    for itr in itrs:
+        nodes = []
+        if isinstance(itr, ExpandRef):
+            for node in itr.nodes:
+                nodes.append((flat_term(node.neg.term), rows(node.neg.memops.idxs),
+                              flat_term(node.pos.term), rows(node.pos.memops.idxs),
+                              redex_id(node.redex)))
+        flat_itrs.append((
+            itr.name(),
+            itr.def_idx if isinstance(itr, ExpandRef) else None,
+            redex_id(itr.redex),
+            [redex_id(redex) for redex in itr.redexes],
+            rows(itr.memops.idxs),
+            nodes
+        ))
+    return flat_itrs, flat_redexes
+
+def flatten(model: Model) -> dict:
+    itrs, redexes = flatten_itrs(model.itrs, model.redexes)
+    table = {name: getattr(model.table, name) for name in MemOpTable.COLUMNS}
+    return {
+        'root': flat_term(model.root),
+        'table': table,
+        'redexes': redexes,
+        'itrs': itrs,
+        'refs': [ref.idx for ref in model.refs],
+        'memop_count': model.memop_count
+    }
+
+def make_itr(name: str, def_idx: Optional[int], idx: int) -> Interaction:
+    if name == AppRef.NAME:
+        return AppRef(def_idx, None, idx)
+    itr = Interaction.get_class(ITRS[name])(None, idx)
+    if isinstance(itr, ExpandRef):
+        itr.def_idx = def_idx
+    return itr
+
+# Rebuilds flattened interactions and redexes at the end of itrs and redexes;
+# the indices in them are relative to where they start.
+def unflatten_itrs(flat_itrs: list, flat_redexes: list, table: MemOpTable,
+                   itrs: list[Interaction], redexes: list[Redex]):
+    itr_base, redex_base = len(itrs), len(redexes)
+
+    def memop_list(idxs) -> MemOpList:
+        memops = MemOpList(table)
+        memops.idxs = idxs
+        return memops
+
+    # interactions and their nodes first; redexes refer to both
+    for idx, (name, def_idx, _, _, memops, nodes) in enumerate(flat_itrs, itr_base):
+        itr = make_itr(name, def_idx, idx)
+        itr.memops = memop_list(memops)
+        for (neg, neg_memops, pos, pos_memops, _) in nodes:
+            node = Node(InPlaceNodeTerm(make_term(neg), memops=memop_list(neg_memops)),
+                        InPlaceNodeTerm(make_term(pos), memops=memop_list(pos_memops)),
+                        itr)
+            node.neg.node = node
+            node.pos.node = node
+            itr.add_node(node)
+        itrs.append(itr)
+
+    def node_at(flat_node: Optional[tuple[int, int]]) -> Optional[Node]:
+        return itrs[itr_base + flat_node[0]].nodes[flat_node[1]] if flat_node else None
+
+    for (seq, tid, itr_name, loc, neg, neg_node, pos, pos_node, psh_itr) in flat_redexes:
+        redexes.append(Redex(
+            seq = seq,
+            tid = tid,
+            itr_name = ITRS[itr_name],
+            op = Op.PUSH,
+            loc = loc,
+            neg = NodeTerm(make_term(neg), node_at(neg_node)),
+            pos = NodeTerm(make_term(pos), node_at(pos_node)),
+            psh_itr = itrs[itr_base + psh_itr] if psh_itr >= 0 else None
+        ))
+
+    for itr, (_, _, redex, itr_redexes, _, nodes) in zip(itrs[itr_base:], flat_itrs):
+        itr.redex = redexes[redex_base + redex] if redex >= 0 else None
+        itr.redexes = [redexes[redex_base + i] for i in itr_redexes]
+        for node, (_, _, _, _, node_redex) in zip(getattr(itr, 'nodes', []), nodes):
+            node.redex = redexes[redex_base + node_redex] if node_redex >= 0 else None
+
+def unflatten(flat: dict) -> Model:
+    table = MemOpTable()
+    for name, column in flat['table'].items():
+        setattr(table, name, column)
+
+    itrs = table.itrs
+    redexes = []
+    unflatten_itrs(flat['itrs'], flat['redexes'], table, itrs, redexes)
+    set_last_access(itrs, table)
+
+    return Model(
+        root = make_term(flat['root']),
+        itrs = itrs,
+        refs = [itrs[idx] for idx in flat['refs']],
+        redexes = redexes,
+        table = table,
+        memop_count = flat['memop_count']
+    )
+
+def save(filename: str, model: Model, cache_dir: Optional[str] = None):
+    stat = os.stat(filename)
+    header = (CACHE_VERSION, stat.st_size, stat.st_mtime_ns, file_hash(filename))
+    path = cache_path(filename, cache_dir)
+    try:
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        with open(path, 'wb') as f:
+            pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(flatten(model), f, pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        print(f"Warning: couldn't write cache '{path}': {e}", file=sys.stderr)
+
+def load(filename: str, cache_dir: Optional[str] = None) -> Optional[Model]:
+    path = cache_path(filename, cache_dir)
+    try:
+        stat = os.stat(filename)
+        with open(path, 'rb') as f:
+            (version, size, mtime_ns, digest) = pickle.load(f)
+            if version != CACHE_VERSION or size != stat.st_size:
+                return None
+            if mtime_ns != stat.st_mtime_ns and digest != file_hash(filename):
+                return None
+            flat = pickle.load(f)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return None
+    # a cache of the wrong shape (e.g. CACHE_VERSION wasn't bumped) is parsed
+    # over rather than trusted
+    try:
+        return unflatten(flat)
+    except (KeyError, IndexError, AttributeError, TypeError, ValueError) as e:
+        print(f"Warning: ignoring unreadable cache '{path}': {e!r}", file=sys.stderr)
+        return None
@@ -1,6 +1,8 @@
 from dataclasses import dataclass
 from typing import NamedTuple, Optional, Tuple
 
+import pygame
+
 TITLE_FONT_SIZE = 14
 FONT_SIZE = 14
 
@@ -47,9 +49,25 @@ class ScrollMgr:
             self.offset = self.end_offset
             self.width = 0
 
+# Areas of the screen that changed since the last frame was drawn. Each
+# manager adds what it changes, both where something was and where it is now;
+# a frame with none isn't drawn at all.
+class DirtyRegions:
+    def __init__(self):
+        self.rects: list[pygame.Rect] = []
+
+    def add(self, rect: pygame.Rect):
+        self.rects.append(pygame.Rect(rect))
+
+    def take(self) -> list[pygame.Rect]:
+        rects = self.rects
+        self.rects = []
+        return rects
+
 class UI:
     def __init__(self):
         self.scroll_mgr = ScrollMgr()
+        self.dirty = DirtyRegions()
 
 ui = UI()
     
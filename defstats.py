@@ -0,0 +1,96 @@
+import sys
+from dataclasses import dataclass, field
+from typing import Optional
+
+from hvm import *
+from liveness import NOT_FREED, Liveness, analyze
+from report import load_models, make_parser, write_rows
+from stats import node_lifetime
+
+# Allocation profile by definition (ExpandRef.def_idx): which definitions'
+# expansions allocate the most nodes, and how long those nodes live.
+#
+# A node's lifetime is from the interaction that created it to the last one
+# that accessed it, as in stats.py. Freed before next is the share of a
+# def's nodes that are freed by the time the def is next expanded; nodes of
+# a def's last expansion aren't counted.
+#
+# MATU32s that create a node are keyed by the node's loc (DefIdx.MAT + loc);
+# they're all counted as one def, matu32.
+
+@dataclass(eq=False)
+class DefStats:
+    def_idx: int
+    expansions: int = 0
+    nodes: int = 0
+    lifetime_total: int = 0
+    lifetime_max: int = 0
+    # nodes of expansions that were followed by another, and how many of
+    # them were freed first
+    followed: int = 0
+    freed_before_next: int = 0
+    # free interaction of each node of the last expansion
+    pending: list[int] = field(default_factory=list)
+
+    def row(self) -> dict:
+        return {
+            'def_idx': self.def_idx,
+            'name': 'matu32' if self.def_idx == DefIdx.MAT else ref_name(self.def_idx),
+            'expansions': self.expansions,
+            'nodes': self.nodes,
+            'lifetime_mean': round(self.lifetime_total / self.nodes, 3) if self.nodes else None,
+            'lifetime_max': self.lifetime_max,
+            'freed_before_next': round(self.freed_before_next / self.followed, 4) if self.followed else None
+        }
+
+# one row per def, most nodes first
+def make_defstats(model: Model, liveness: Optional[Liveness] = None) -> list[dict]:
+    if not liveness:
+        liveness = analyze(model.root, model.itrs)
+    defs: dict[int, DefStats] = {}
+    for itr in model.itrs:
+        # a MATU32 is only an expansion if it creates a node
+        if not isinstance(itr, ExpandRef) or not itr.nodes: continue
+        def_idx = min(itr.def_idx, DefIdx.MAT)
+        stats = defs.get(def_idx)
+        if not stats:
+            stats = defs[def_idx] = DefStats(def_idx)
+        stats.expansions += 1
+        stats.nodes += len(itr.nodes)
+
+        # nodes freed at the start of this interaction are freed before it
+        # allocates
+        for free_itr in stats.pending:
+            if free_itr != NOT_FREED and free_itr <= itr.idx:
+                stats.freed_before_next += 1
+        stats.followed += len(stats.pending)
+        stats.pending = []
+
+        for node in itr.nodes:
+            lifetime = node_lifetime(model, node)
+            stats.lifetime_total += lifetime
+            stats.lifetime_max = max(stats.lifetime_max, lifetime)
+            stats.pending.append(liveness.free_itr(node))
+    rows = [stats.row() for stats in defs.values()]
+    return sorted(rows, key=lambda row: (-row['nodes'], row['def_idx']))
+
+FIELDS = ('memlog', 'def_idx', 'name', 'expansions', 'nodes', 'lifetime_mean',
+          'lifetime_max', 'freed_before_next')
+
+def main(filenames: list[str], fmt: str = 'csv', output: Optional[str] = None,
+         workers: int = 1, use_cache: bool = True, cache_dir: Optional[str] = None) -> int:
+    results = []
+    failed = []
+    for (filename, model) in load_models(filenames, workers, use_cache, cache_dir, failed):
+        results += ({'memlog': filename, **row} for row in make_defstats(model))
+
+    # JSON is one line per memlog and def
+    write_rows(results, FIELDS, fmt, output)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    parser = make_parser('defstats')
+    args = parser.parse_args()
+
+    sys.exit(main(args.filenames, args.format, args.output, args.jobs,
+                  not args.no_cache, args.cache_dir))
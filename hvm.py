@@ -1,87 +1,347 @@
 from abc import ABC, abstractmethod
+from array import array
 from dataclasses import dataclass, field
 from enum import IntEnum
 from typing import ClassVar, NamedTuple, Optional
 
-HAS_LOC_TAGS = {'VAR', 'LAM', 'APP', 'SUP', 'DUP', 'OPX', 'OPY', 'MAT'}
-NUM_TAGS = {'U32', 'I32', 'F32'}
-TAKEN_TAG = "___"
-EMPTY_TAG = "EMP"
+# Tags, ops and interaction names are small ints, assigned once by the parser.
+# They are only turned back into strings for display, via __str__/__format__.
+
+class Tag(IntEnum):
+    EMP = 0 # viewer only; an empty node term
+    TKN = 1 # '___', a taken term
+    DP0 = 2
+    DP1 = 3
+    VAR = 4
+    SUB = 5
+    REF = 6
+    LET = 7
+    APP = 8
+    ERA = 9
+    LAM = 10
+    SUP = 11
+    DUP = 12
+    CTR = 13
+    MAT = 14
+    IFL = 15
+    SWI = 16
+    W32 = 17
+    CHR = 18
+    OPX = 19
+    OPY = 20
+    U32 = 21
+    I32 = 22
+    F32 = 23
+
+    def __str__(self) -> str:
+        return '___' if self == Tag.TKN else self.name
+
+    def __format__(self, spec: str) -> str:
+        return format(str(self), spec)
+
+TAG_BITS = 5
+TAG_MASK = (1 << TAG_BITS) - 1
+TAGS: dict[str, Tag] = {str(tag): tag for tag in Tag}
+# indexed by tag code
+TAG_LIST: tuple[Tag, ...] = tuple(Tag)
+# tag code for a missing got/put term in a MemOpTable
+NO_TAG = 0xFF
+
+def bit_mask(*codes: int) -> int:
+    mask = 0
+    for code in codes:
+        mask |= 1 << code
+    return mask
+
+HAS_LOC_MASK = bit_mask(Tag.VAR, Tag.LAM, Tag.APP, Tag.SUP, Tag.DUP, Tag.OPX, Tag.OPY, Tag.MAT)
+NUM_MASK = bit_mask(Tag.U32, Tag.I32, Tag.F32)
+
+class Op(IntEnum):
+    LOAD = 0
+    STOR = 1
+    EXCH = 2
+    POP  = 3
+    PUSH = 4 # a Redex; a pair of STORs to the redex bag
+
+    def __str__(self) -> str:
+        return self.name
+
+    def __format__(self, spec: str) -> str:
+        return format(str(self), spec)
+
+OPS: dict[str, Op] = {str(op): op for op in Op}
+READ_MASK = bit_mask(Op.LOAD, Op.POP)
+
+# An interaction name is the pair of tags of the redex that started it.
+def itr_code(neg: int, pos: int) -> int:
+    return (neg << TAG_BITS) | pos
+
+def itr_str(code: int) -> str:
+    return f"{Tag(code >> TAG_BITS)}{Tag(code & TAG_MASK)}"
+
+class Itr(IntEnum):
+    ROOT   = itr_code(Tag.TKN, Tag.TKN)
+    APPREF = itr_code(Tag.APP, Tag.REF)
+    APPLAM = itr_code(Tag.APP, Tag.LAM)
+    ERAREF = itr_code(Tag.ERA, Tag.REF)
+    MATREF = itr_code(Tag.MAT, Tag.REF)
+    MATU32 = itr_code(Tag.MAT, Tag.U32)
+    OPXU32 = itr_code(Tag.OPX, Tag.U32)
+    OPYU32 = itr_code(Tag.OPY, Tag.U32)
+    DUPU32 = itr_code(Tag.DUP, Tag.U32)
+
+    def __str__(self) -> str:
+        return itr_str(self)
+
+    def __format__(self, spec: str) -> str:
+        return format(str(self), spec)
+
+# every tag pair, including those this viewer has no Interaction class for
+ITRS: dict[str, int] = {
+    itr_str(code): code for code in (itr_code(neg, pos) for neg in Tag for pos in Tag)
+}
+ITRS.update({str(itr): itr for itr in Itr})
 
 class Term(NamedTuple):
-    tag: str
+    tag: Tag
     lab: int
     loc: int
 
     def __repr__(self) -> str:
-        return f"{self.tag[:3]},{self.lab:03d},{self.loc:04d}"
+        return f"{self.tag},{self.lab:03d},{self.loc:04d}"
 
     def taken(self) -> bool:
-        return self.tag == TAKEN_TAG
+        return self.tag == Tag.TKN
 
     def has_loc(self) -> bool:
-        return self.tag in HAS_LOC_TAGS
+        return (HAS_LOC_MASK >> self.tag) & 1 == 1
 
     def has_num_tag(self) -> bool:
-        return self.tag in NUM_TAGS
+        return (NUM_MASK >> self.tag) & 1 == 1
 
-EMPTY_TERM = Term(EMPTY_TAG, 0, 0)
-TAKEN_TERM = Term(TAKEN_TAG, 0, 0)
+EMPTY_TERM = Term(Tag.EMP, 0, 0)
+TAKEN_TERM = Term(Tag.TKN, 0, 0)
 
-@dataclass(eq=False)
+# The fields a MemOp and a Redex (a pair of STORs) have in common. It has no
+# slots of its own, so MemOp views don't get a __dict__.
 class MemOpBase:
+    __slots__ = ()
+
     seq: int
     tid: int
-    itr_name: str
-    op: str
+    itr_name: int
+    op: Op
     loc: int
 
-@dataclass(eq=False)
-class MemOp(MemOpBase):
+# The parsed fields of a single memlog line
+class MemOpFields(NamedTuple):
+    seq: int
+    tid: int
+    itr_name: int
+    op: Op
     lvl: int
-    put: Optional[Term] = None
-    got: Optional[Term] = None
+    got: Optional[Term]
+    put: Optional[Term]
+    loc: int
+    # the log's first column; units are whatever the logger used
+    ts: int = 0
+
+# Columnar storage for every MemOp in a trace; one array per field rather
+# than one object per memop. A MemOp is just a (table, index) view into it.
+class MemOpTable:
+    COLUMNS = ('seq', 'tid', 'itr_name', 'op', 'lvl', 'got_tag', 'got_loc',
+               'put_tag', 'put_loc', 'loc', 'ts', 'itr', 'node_ref', 'node')
+
+    def __init__(self):
+        self.seq = array('Q')
+        self.tid = array('H')
+        self.itr_name = array('H')
+        self.op = array('B')
+        self.lvl = array('H')
+        self.got_tag = array('B')
+        # term payloads; an I32's is negative, a U32's needs all 32 bits
+        self.got_loc = array('q')
+        self.put_tag = array('B')
+        self.put_loc = array('q')
+        self.loc = array('I')
+        self.ts = array('Q')
+        # the originating interaction, as an index into itrs; -1 if not set
+        self.itr = array('i')
+        # the node operated on, as the index in itrs of the ExpandRef that
+        # owns it and its index within that ref; -1 if not set
+        self.node_ref = array('i')
+        self.node = array('i')
+        # all interactions of the trace, filled in by the parser
+        self.itrs: list['Interaction'] = []
+
+    def __len__(self) -> int:
+        return len(self.seq)
+
+    def __getitem__(self, idx: int) -> 'MemOp':
+        return MemOp(self, idx)
+
+    # append all rows of another (unlinked) table, e.g. one parsed elsewhere
+    def extend(self, other: 'MemOpTable'):
+        for name in MemOpTable.COLUMNS:
+            getattr(self, name).extend(getattr(other, name))
+
+    def append(self, fields: MemOpFields) -> 'MemOp':
+        idx = len(self.seq)
+        self.seq.append(fields.seq)
+        self.tid.append(fields.tid)
+        self.itr_name.append(fields.itr_name)
+        self.op.append(fields.op)
+        self.lvl.append(fields.lvl)
+        got, put = fields.got, fields.put
+        self.got_tag.append(got.tag if got else NO_TAG)
+        self.got_loc.append(got.loc if got else 0)
+        self.put_tag.append(put.tag if put else NO_TAG)
+        self.put_loc.append(put.loc if put else 0)
+        self.loc.append(fields.loc)
+        self.ts.append(fields.ts)
+        self.itr.append(-1)
+        self.node_ref.append(-1)
+        self.node.append(-1)
+        return MemOp(self, idx)
+
+# A view of one row of a MemOpTable
+class MemOp(MemOpBase):
+    __slots__ = ('table', 'idx')
+
+    def __init__(self, table: MemOpTable, idx: int):
+        self.table = table
+        self.idx = idx
+
+    @property
+    def seq(self) -> int: return self.table.seq[self.idx]
+    @seq.setter
+    def seq(self, seq: int): self.table.seq[self.idx] = seq
+    @property
+    def tid(self) -> int: return self.table.tid[self.idx]
+    @property
+    def itr_name(self) -> int: return self.table.itr_name[self.idx]
+    @property
+    def op(self) -> Op: return Op(self.table.op[self.idx])
+    @property
+    def lvl(self) -> int: return self.table.lvl[self.idx]
+    @property
+    def loc(self) -> int: return self.table.loc[self.idx]
+    @property
+    def ts(self) -> int: return self.table.ts[self.idx]
+
+    @property
+    def got(self) -> Optional[Term]:
+        tag = self.table.got_tag[self.idx]
+        return Term(TAG_LIST[tag], 0, self.table.got_loc[self.idx]) if tag != NO_TAG else None
+
+    @property
+    def put(self) -> Optional[Term]:
+        tag = self.table.put_tag[self.idx]
+        return Term(TAG_LIST[tag], 0, self.table.put_loc[self.idx]) if tag != NO_TAG else None
+
     # a MemOp originates in an interaction
-    itr: Optional['Interaction'] = None
+    @property
+    def itr(self) -> Optional['Interaction']:
+        itr_idx = self.table.itr[self.idx]
+        return self.table.itrs[itr_idx] if itr_idx >= 0 else None
+
+    @itr.setter
+    def itr(self, itr: 'Interaction'):
+        self.table.itr[self.idx] = itr.idx
+
     # a MemOp operates on a memory location within a Node
-    node: Optional['Node'] = None
+    @property
+    def node(self) -> Optional['Node']:
+        ref_idx = self.table.node_ref[self.idx]
+        if ref_idx < 0: return None
+        return self.table.itrs[ref_idx].nodes[self.table.node[self.idx]]
+
+    @node.setter
+    def node(self, node: 'Node'):
+        self.table.node_ref[self.idx] = node.ref.idx
+        self.table.node[self.idx] = node.idx
 
     def __repr__(self) -> str:
-        if self.op == 'EXCH':
-            return f"{self.tid},{self.itr_name},{self.op},{self.lvl},{self.got.tag},{self.got.loc},{self.put.tag},{self.put.loc},{self.loc}"
-        elif self.op in ('POP', 'LOAD'):
-            return f"{self.tid},{self.itr_name},{self.op},{self.lvl},{self.got.tag},{self.got.loc},{self.loc}"
-        else: # self.op == 'STOR'
-            return f"{self.tid},{self.itr_name},{self.op},{self.lvl},{self.put.tag},{self.put.loc},{self.loc}"
+        return f"{self.tid},{itr_str(self.itr_name)},{self}"
 
     def __str__(self) -> str:
-        if self.op == 'EXCH':
-            return f"{self.op},{self.lvl},{self.got.tag},{self.got.loc},{self.put.tag},{self.put.loc},{self.loc}"
-        elif self.op in ('POP', 'LOAD'):
-            return f"{self.op},{self.lvl},{self.got.tag},{self.got.loc},{self.loc}"
-        else: # self.op == 'STOR'
-            return f"{self.op},{self.lvl},{self.put.tag},{self.put.loc},{self.loc}"
+        op = self.op
+        if op == Op.EXCH:
+            return f"{op},{self.lvl},{self.got.tag},{self.got.loc},{self.put.tag},{self.put.loc},{self.loc}"
+        elif op in (Op.POP, Op.LOAD):
+            return f"{op},{self.lvl},{self.got.tag},{self.got.loc},{self.loc}"
+        else: # op == Op.STOR
+            return f"{op},{self.lvl},{self.put.tag},{self.put.loc},{self.loc}"
 
     def is_exch(self) -> bool:
-        return self.op == 'EXCH'
+        return self.table.op[self.idx] == Op.EXCH
 
     def is_take(self) -> bool:
-        return self.is_exch() and self.put.taken()
+        return self.is_exch() and self.table.put_tag[self.idx] == Tag.TKN
 
     def is_swap(self) -> bool:
-        return self.is_exch() and not self.put.taken()
+        return self.is_exch() and self.table.put_tag[self.idx] != Tag.TKN
 
     def is_root_itr(self) -> bool:
-        return self.itr_name == '______'
+        return self.itr_name == Itr.ROOT
 
     def is_appref_itr(self) -> bool:
-        return self.itr_name == 'APPREF'
+        return self.itr_name == Itr.APPREF
 
     def is_applam_itr(self) -> bool:
-        return self.itr_name == 'APPLAM'
+        return self.itr_name == Itr.APPLAM
 
     def is_matnum_itr(self) -> bool:
-        return self.itr_name[:3] == 'MAT' and self.itr_name[3:] in NUM_TAGS
+        itr_name = self.itr_name
+        return ((itr_name >> TAG_BITS) == Tag.MAT and
+                (NUM_MASK >> (itr_name & TAG_MASK)) & 1 == 1)
+
+# A list of MemOps, held as indices into a MemOpTable
+class MemOpList:
+    __slots__ = ('table', 'idxs')
+
+    def __init__(self, table: Optional[MemOpTable] = None):
+        self.table = table
+        self.idxs = array('I')
+
+    @classmethod
+    def of(cls, memop: MemOp) -> 'MemOpList':
+        memops = cls(memop.table)
+        memops.idxs.append(memop.idx)
+        return memops
+
+    def __len__(self) -> int:
+        return len(self.idxs)
+
+    def __getitem__(self, i: int) -> MemOp:
+        return MemOp(self.table, self.idxs[i])
+
+    def __iter__(self):
+        for idx in self.idxs:
+            yield MemOp(self.table, idx)
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    # the loc of the i'th memop, without making a view
+    def loc(self, i: int) -> int:
+        return self.table.loc[self.idxs[i]]
+
+    def append(self, memop: MemOp):
+        assert self.table is None or self.table is memop.table
+        self.table = memop.table
+        self.idxs.append(memop.idx)
+
+# The position of a memop in the order the viewer executes them, i.e. by
+# interaction, then by row. The viewer's cursor is the key of the last memop
+# it executed (or of row -1 of the current interaction), so anything whose
+# last access key is <= the cursor will never be accessed again.
+def access_key(itr_idx: int, row: int) -> int:
+    return (itr_idx << 32) + row + 1
+
+# the last access key of a term whose last access isn't known yet; it's
+# greater than any cursor
+UNKNOWN_ACCESS = 1 << 63
 
 # A "moveable" term + the node (if any) it originated from
 @dataclass(eq=False)
@@ -121,10 +381,19 @@ class HasNodes(ABC):
 
 @dataclass(eq=False)
 class Redex(MemOpBase):
+    # MemOpBase
+    seq: int
+    tid: int
+    itr_name: int
+    op: Op
+    loc: int
+    # Redex
     neg: NodeTerm
     pos: NodeTerm
     # the interaction this redex was pushed from
     psh_itr: Optional['Interaction'] = None
+    # the pair of STORs that pushed it, while it's being parsed
+    stors: tuple['MemOp', ...] = ()
 
     def __repr__(self) -> str:
         return f"Redex {self.neg} {self.pos} psh_itr.idx({self.psh_itr.idx})"
@@ -145,8 +414,8 @@ class Redex(MemOpBase):
                 node._init_redex(self)
 
     # explicit name due to clash with MemOp.itr_name field
-    def redex_itr_name(self) -> str:
-        return f"{self.neg.tag}{self.pos.tag}"
+    def redex_itr_name(self) -> int:
+        return itr_code(self.neg.tag, self.pos.tag)
 
     def get_node_term(self, term: Term) -> Optional[NodeTerm]:
         if term == self.neg: return self.neg
@@ -156,7 +425,7 @@ class Redex(MemOpBase):
     @classmethod
     def new(cls, neg: MemOp, pos: MemOp):
         assert neg.itr_name == pos.itr_name
-        assert (neg.op, pos.op) == ('STOR', 'STOR')
+        assert (neg.op, pos.op) == (Op.STOR, Op.STOR)
         assert neg.put and pos.put
         assert pos.loc == neg.loc + 1
         return cls(
@@ -164,27 +433,34 @@ class Redex(MemOpBase):
             seq = neg.seq,
             tid = neg.tid,
             itr_name = neg.itr_name,
-            op = 'PUSH',
+            op = Op.PUSH,
             loc = neg.loc,
             # Redex
             neg = NodeTerm(neg.put),
-            pos = NodeTerm(pos.put)
+            pos = NodeTerm(pos.put),
+            stors = (neg, pos)
         )
 
 # A static node term that represents a fixed location in "node memory"
 @dataclass(eq=False)
 class InPlaceNodeTerm(NodeTerm):
-    memops: list[MemOp] = field(default_factory=list)
+    memops: MemOpList = field(default_factory=MemOpList)
     memop_idx: int = 0
     empty: bool = False
     # the origin node (and term) of whatever term currently inhabits this node
     origin: Optional[NodeTerm] = None
+    # index of the final memop (as far as the log has been read), when it's
+    # known before all memops are linked
+    last_idx: Optional[int] = None
+    # access_key of the final memop; 0 if the term is only ever stored when
+    # its node is created
+    last_access: int = 0
 
     # hack (i think) for determining ref dependencies. feels wrong. re-visit.
     #loads: list[MemOp] = field(default_factory=list)
 
     @property
-    def mem_loc(self): return self.memops[0].loc
+    def mem_loc(self): return self.memops.loc(0)
 
     def __repr__(self) -> str:
         base_repr = super().__repr__()
@@ -201,13 +477,17 @@ class InPlaceNodeTerm(NodeTerm):
             self.empty = False
         else:
             self.empty = True
+        self.node.ref.version += 1
 
     def set_origin(self, nod_trm: NodeTerm):
         self.set(nod_trm.term)
         self.origin = nod_trm
         
-    def memops_done(self):
-        return self.memop_idx == len(self.memops) - 1
+    def last_memop_idx(self) -> int:
+        return self.last_idx if self.last_idx is not None else len(self.memops) - 1
+
+    def done(self, cursor: int) -> bool:
+        return self.last_access <= cursor
 
 @dataclass(eq=False)
 class NodeProxy:
@@ -278,6 +558,25 @@ class Node:
 class DefIdx(IntEnum):
     MAT = 1024
 
+def ref_name(def_idx: int):
+    d = {
+        0: "height",
+        1: "leaf",
+        2: "main",
+        3: "make",
+        4: "make_leaf",
+        5: "make_node",
+        6: "node",
+        7: "sum",
+        8: "sum_leaf",
+        9: "sum_node"
+    }
+    if def_idx > DefIdx.MAT:
+        def_idx -= DefIdx.MAT
+        return f"matu32_{def_idx}"
+    else:
+        return d.get(def_idx, f"ref_{def_idx}")
+
 @dataclass(eq=False, kw_only=True)
 class Interaction(ABC):
     idx: int
@@ -285,28 +584,33 @@ class Interaction(ABC):
     redex: Optional[Redex] = None
     # redexes pushed in this interaction
     redexes: list[Redex] = field(default_factory=list)
-    memops: list[MemOp] = field(default_factory=list)
+    memops: MemOpList = field(default_factory=MemOpList)
 
-    registry: ClassVar[dict[str, type]] = {}
+    registry: ClassVar[dict[int, type]] = {}
 
     def __init_subclass__(cls, **kwargs):
         super().__init_subclass__(**kwargs)
         name = getattr(cls, 'NAME', None)
         if name:
-            Interaction.registry[name] = cls
+            Interaction.registry[ITRS[name]] = cls
 
     @abstractmethod
     def name(self) -> str:
         pass
 
     @classmethod
-    def get_class(cls, name: str) -> type:
-        return Interaction.registry[name]
+    def get_class(cls, itr_name: int) -> type:
+        return Interaction.registry[itr_name]
 
 @dataclass(eq=False, kw_only=True)
 class ExpandRef(Interaction, HasNodes):
     def_idx: int
     nodes: list[Node] = field(default_factory=list)
+    # latest last_access of any of its node terms
+    last_access: int = 0
+    # bumped whenever one of its node terms is set, so the viewer knows when
+    # to redraw it
+    version: int = 0
 
     @property
     def id(self) -> int: return (self.def_idx, self.first_loc())
@@ -329,21 +633,54 @@ class ExpandRef(Interaction, HasNodes):
         self.nodes.append(node)
 
     def node_at(self, loc: int) -> Optional[Node]:
+        if not self.nodes or not self.contains(loc):
+            return None
+        # nodes are laid out contiguously, two locs each
+        idx = (loc - self.first_loc()) >> 1
+        if idx < len(self.nodes) and self.nodes[idx].contains(loc):
+            return self.nodes[idx]
         for node in self.nodes:
             if node.contains(loc):
                 return node
         return None
 
-    def memops_done(self) -> bool:
-        for node in self.nodes:
-            for node_term in (node.neg, node.pos):
-                if not node_term.memops_done():
-                    return False
-        return True
+    # done once all of its node terms are
+    def done(self, cursor: int) -> bool:
+        return self.last_access <= cursor
 
     def name(self) -> str:
         pass
 
+# Maps a node memory loc to the Node at that loc. Node locs are dense, so this
+# is a flat list indexed by loc rather than a search over refs.
+# Node memory is dense within each thread's heap, but with more than one
+# thread the heaps are far apart, so nodes are indexed by page.
+NODE_PAGE_BITS = 16
+NODE_PAGE_SIZE = 1 << NODE_PAGE_BITS
+
+class NodeIndex:
+    def __init__(self):
+        self.pages: dict[int, list[Optional[Node]]] = {}
+
+    def add(self, node: Node):
+        neg_loc = node.neg.mem_loc
+        # neg is even, so neg and pos are always on the same page
+        page = self.pages.get(neg_loc >> NODE_PAGE_BITS)
+        if page is None:
+            page = [None] * NODE_PAGE_SIZE
+            self.pages[neg_loc >> NODE_PAGE_BITS] = page
+        offset = neg_loc & (NODE_PAGE_SIZE - 1)
+        page[offset] = node
+        page[offset + 1] = node
+
+    def node_at(self, loc: int) -> Optional[Node]:
+        page = self.pages.get(loc >> NODE_PAGE_BITS)
+        return page[loc & (NODE_PAGE_SIZE - 1)] if page else None
+
+    def ref_at(self, loc: int) -> Optional[ExpandRef]:
+        node = self.node_at(loc)
+        return node.ref if node else None
+
 @dataclass(eq=False)
 class AppRef(ExpandRef):
     NAME = 'APPREF'
@@ -357,7 +694,7 @@ class AppRef(ExpandRef):
 
     def add_node(self, node: Node):
         super().add_node(node)
-        if len(self.nodes) == 1 and self.nodes[0].neg.tag == 'MAT':
+        if len(self.nodes) == 1 and self.nodes[0].neg.tag == Tag.MAT:
             self.mat = True
 
     def get_context(self, nod_trm: NodeTerm) -> str:
@@ -448,3 +785,26 @@ class MatU32(ExpandRef):
 
     def name(self) -> str:
         return MatU32.NAME
+
+# Sets the last access key of every node term and ref, from the memops that
+# were linked to them.
+def set_last_access(itrs: list[Interaction], table: MemOpTable):
+    itr_column = table.itr
+    for itr in itrs:
+        if not isinstance(itr, ExpandRef): continue
+        for node in itr.nodes:
+            for nod_trm in (node.neg, node.pos):
+                row = nod_trm.memops.idxs[-1]
+                itr_idx = itr_column[row]
+                # node stores aren't linked to an interaction
+                nod_trm.last_access = access_key(itr_idx, row) if itr_idx >= 0 else 0
+                itr.last_access = max(itr.last_access, nod_trm.last_access)
+
+# A fully parsed and linked trace
+class Model(NamedTuple):
+    root: Optional[Term]
+    itrs: list[Interaction]
+    refs: list[ExpandRef]
+    redexes: list[Redex]
+    table: MemOpTable
+    memop_count: int
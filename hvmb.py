@@ -0,0 +1,127 @@
+from array import array
+import mmap
+import struct
+import sys
+from typing import Optional
+
+from hvm import NO_TAG, OPS, TAG_BITS, TAG_LIST, TAG_MASK, TAGS, MemOpTable, Op
+
+# Binary memlog (.hvmb) layout, little endian:
+#
+#   header:  magic(4) version(u16) tags_len(u16) ops_len(u16) count(u64)
+#   names:   tag and op names as comma-separated ascii, in code order; the
+#            tag and op codes stored in the columns are indices into these.
+#   columns: count values of each of COLUMNS in turn, each stored with the
+#            typecode of the matching MemOpTable array.
+#
+# One row per memlog line. got/put tags are NO_TAG for ops that don't have
+# that term (STOR has no got, LOAD/POP have no put). Itr names are stored
+# as itr codes, i.e. pairs of tag codes.
+#
+# Since the columns are stored the way MemOpTable keeps them, reading is
+# just copying each column into its array, with no per-memop work.
+
+HVMB_EXT = '.hvmb'
+MAGIC = b'HVMB'
+VERSION = 4
+
+HEADER = struct.Struct('<4sHHHQ')
+# the MemOpTable columns read from the log; the rest are filled in by the
+# parser
+COLUMNS = ('seq', 'tid', 'itr_name', 'op', 'lvl', 'got_tag', 'got_loc',
+           'put_tag', 'put_loc', 'loc', 'ts')
+
+def encode_names(names) -> bytes:
+    return ','.join(str(name) for name in names).encode('ascii')
+
+def decode_names(data: bytes) -> list[str]:
+    return data.decode('ascii').split(',') if data else []
+
+def write_hvmb(table: MemOpTable, filename: str) -> int:
+    tags, ops = encode_names(TAG_LIST), encode_names(Op)
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(tags), len(ops), len(table)))
+        f.write(tags)
+        f.write(ops)
+        for name in COLUMNS:
+            column = getattr(table, name)
+            if sys.byteorder == 'big':
+                column = array(column.typecode, column)
+                column.byteswap()
+            column.tofile(f)
+    return len(table)
+
+# Maps the codes of a file written with a different Tag or Op enum to ours;
+# None if they're the same.
+def code_map(names: list[str], codes: dict) -> Optional[list[int]]:
+    mapped = [codes[name] for name in names]
+    return None if mapped == list(range(len(mapped))) else mapped
+
+# column is of single byte codes; NO_TAG is left as is
+def translate_codes(column: array, mapped: list[int]) -> array:
+    table = bytearray(range(256))
+    table[:len(mapped)] = bytes(mapped)
+    return array(column.typecode, column.tobytes().translate(table))
+
+# Appends every memop of the file to table, and returns how many there were.
+def read_hvmb(filename: str, table: MemOpTable) -> int:
+    with open(filename, 'rb') as f, \
+         mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+         memoryview(mm) as view:
+        (magic, version, tags_len, ops_len, count) = HEADER.unpack_from(mm)
+        if magic != MAGIC or version != VERSION:
+            raise RuntimeError(f"'{filename}' is not a version {VERSION} {HVMB_EXT} file")
+
+        offset = HEADER.size
+        tags = code_map(decode_names(mm[offset:offset + tags_len]), TAGS)
+        offset += tags_len
+        ops = code_map(decode_names(mm[offset:offset + ops_len]), OPS)
+        offset += ops_len
+
+        first = len(table)
+        for name in COLUMNS:
+            column = getattr(table, name)
+            size = count * column.itemsize
+            if sys.byteorder == 'big':
+                loaded = array(column.typecode, view[offset:offset + size])
+                loaded.byteswap()
+                column.extend(loaded)
+            else:
+                column.frombytes(view[offset:offset + size])
+            offset += size
+        assert offset == len(mm), f"'{filename}' has {len(mm) - offset} extra bytes"
+
+    for name in ('itr', 'node_ref', 'node'):
+        getattr(table, name).extend(array('i', [-1]) * count)
+
+    if tags:
+        assert len(tags) <= NO_TAG
+        table.got_tag[first:] = translate_codes(table.got_tag[first:], tags)
+        table.put_tag[first:] = translate_codes(table.put_tag[first:], tags)
+        table.itr_name[first:] = array('H', (
+            (tags[code >> TAG_BITS] << TAG_BITS) | tags[code & TAG_MASK]
+            for code in table.itr_name[first:]
+        ))
+    if ops:
+        table.op[first:] = translate_codes(table.op[first:], ops)
+    return count
+
+def convert(filename: str, out_filename: Optional[str] = None) -> str:
+    # deferred; parse imports this module
+    from parse import iter_lines, parse_lines
+
+    if not out_filename:
+        out_filename = filename + HVMB_EXT
+    table = MemOpTable()
+    for fields in parse_lines(iter_lines(filename)):
+        table.append(fields)
+    count = write_hvmb(table, out_filename)
+    print(f"wrote {count} memops to {out_filename}")
+    return out_filename
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"usage: hvmb <memlog> [<out{HVMB_EXT}>]")
+        sys.exit(1)
+
+    convert(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
@@ -1,6 +1,9 @@
+from typing import Optional
+
 import pygame
 
 from anim import AnimManager
+from commonui import ui
 from freeui import FreeManager
 from fonts import fonts
 from refui import RefManager
@@ -27,6 +30,8 @@ class ItrManager:
         self.itr_idx = 0
         self.op_idx = 0
         self.rect = self.init_rect(screen)
+        # what the section was last drawn for
+        self.drawn: Optional[tuple[int, int, bool]] = None
 
     def init_rect(self, screen: pygame.Surface) -> pygame.Rect:
         width = 240
@@ -51,12 +56,10 @@ class ItrManager:
 
         x = self.rect.x + 5
         y = self.rect.y + 5
-        surf = title_font.render(text, True, header_color)
-        self.screen.blit(surf, (x, y))
+        self.text_cache.draw(self.screen, title_font, text, (x, y), header_color)
         if text2:
             y += self.table['metrics']['line_height'] + self.table['row_spacing']['intra_row']
-            surf = title_font.render(text2, True, header_color)
-            self.screen.blit(surf, (x, y))
+            self.text_cache.draw(self.screen, title_font, text2, (x, y), header_color)
 
     def draw_memops(self, surface: pygame.Surface, memops: list[MemOp]):
         font = fonts.content
@@ -70,29 +73,47 @@ class ItrManager:
             else:
                 color = ORANGE
             #color = sel_text_color if i == self.op_idx else text_color
-            text_surface = font.render(text, True, color)
-            surface.blit(text_surface, (x, y))
+            self.text_cache.draw(surface, font, text, (x, y), color)
             y += line_height
 
     def done(self):
         return self.itr_idx >= len(self.itrs)
 
+    # the current memop is highlighted by whether animations are ready
+    def update(self):
+        drawn = (self.itr_idx, self.op_idx, self.anim_mgr.ready)
+        if drawn != self.drawn:
+            ui.dirty.add(self.rect)
+            self.drawn = drawn
+
     def draw(self):
         if self.done(): return
         itr = self.itrs[self.itr_idx]
         self.draw_header(self.screen, itr)
         self.draw_memops(self.screen, itr.memops)
 
+    # log time of the memop that next() would execute; None if there isn't
+    # one, i.e. next() moves on to the next interaction
+    def next_ts(self) -> Optional[int]:
+        if self.done(): return None
+        memops = self.itrs[self.itr_idx].memops
+        return memops[self.op_idx].ts if self.op_idx < len(memops) else None
+
     def next(self):
         if self.done() or not self.anim_mgr.ready: return False
         itr = self.itrs[self.itr_idx]
         memop = itr.memops[self.op_idx] if self.op_idx < len(itr.memops) else None
         self.op_idx += 1
         if memop:
+            # every memop before this one is done; this one is once its put
+            # term lands, which for a swap is when its animation ends
+            access = access_key(itr.idx, memop.idx)
+            self.ref_mgr.cursor = access - 1
             self.anim_mgr.animate(memop)
-            self.free_mgr.on_memop(memop)
             # execute must be called last
             self.execute(memop)
+            if memop.is_take():
+                self.ref_mgr.cursor = access
         else:
             rmvd = self.anim_mgr.remove_waiting()
             self.itr_idx += 1
@@ -104,6 +125,7 @@ class ItrManager:
         return True
 
     def on_itr(self, itr: Interaction):
+        self.ref_mgr.cursor = access_key(itr.idx, -1)
         self.free_mgr.on_itr(itr)
         if isinstance(itr, ExpandRef) and itr.nodes:
             self.ref_mgr.add_ref(itr, "dim terminal")
@@ -113,3 +135,28 @@ class ItrManager:
             memop.node.take(memop.loc)
         elif memop.is_swap():
             memop.node.swap(memop.loc)
+
+# Steps an ItrManager at the pace of the memlog's timestamps, scaled to
+# `scale` log time units per second. It steps at most once per frame, and
+# memops wait for animations, so a memop can be stepped late; the replay then
+# restarts its clock from that memop, keeping the gaps between the ones after.
+class RealtimeReplay:
+    def __init__(self, itr_mgr: ItrManager, scale: float):
+        self.itr_mgr = itr_mgr
+        self.scale = scale
+        # wall time and log time of the memop the clock was started from
+        self.start: Optional[tuple[float, int]] = None
+        # whether a memop was due but couldn't be stepped yet
+        self.stalled = False
+
+    def update(self, now: float):
+        ts = self.itr_mgr.next_ts()
+        if ts is not None and self.start:
+            if self.start[0] + (ts - self.start[1]) / self.scale > now:
+                return
+        if not self.itr_mgr.next():
+            self.stalled = ts is not None
+            return
+        if ts is not None and (not self.start or self.stalled):
+            self.start = (now, ts)
+            self.stalled = False
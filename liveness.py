@@ -0,0 +1,357 @@
+from array import array
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, NamedTuple, Optional, Sequence
+
+from hvm import *
+
+# Node liveness, i.e. when node space becomes free.
+#
+# RefCounter counts the references to each loc, from terms in node memory and
+# from pushed redexes, as interactions and their memops are executed. At the
+# start of each interaction, any loc whose count dropped to zero during the
+# previous one is checked, and a node with no references to either of its
+# terms is freed; that drops the references held by its terms, which may free
+# more nodes.
+#
+# Freeing is a worklist over neg locs, so its cost is proportional to the
+# references dropped by the nodes actually freed. Nodes are found by loc in
+# the counter's own NodeIndex, built from the ExpandRefs it's seen.
+#
+# An Analysis replays interactions through one to find when each node is
+# freed. analyze() replays a whole model, headless, in a single pass; the
+# viewer steps one along with a lazy model, as it's linked.
+#
+# Refcounting can't free cycles, and it trusts the memlog's put/got pairs, so
+# analyze() can also cross-check it against reachability: every stride
+# interactions, it traces node memory from the root and the live redexes and
+# reports nodes the two disagree about.
+
+# The reference count of each loc, and whether its node has been freed. Like
+# NodeIndex, they're kept in pages of NODE_PAGE_SIZE locs, allocated as locs
+# on them are first counted, so the far apart heaps of different threads
+# don't need counts for the locs in between.
+REFCNT_PAGE_MASK = NODE_PAGE_SIZE - 1
+
+class RefCounts:
+    def __init__(self):
+        # counts, and one free bit per loc, by page
+        self.pages: dict[int, tuple[array, bytearray]] = {}
+
+    def page(self, loc: int) -> tuple[array, bytearray]:
+        page = self.pages.get(loc >> NODE_PAGE_BITS)
+        if page is None:
+            page = (array('i', bytes(4 * NODE_PAGE_SIZE)), bytearray(NODE_PAGE_SIZE >> 3))
+            self.pages[loc >> NODE_PAGE_BITS] = page
+        return page
+
+    def cnt(self, loc: int) -> int:
+        page = self.pages.get(loc >> NODE_PAGE_BITS)
+        return page[0][loc & REFCNT_PAGE_MASK] if page else 0
+
+    def is_free(self, loc: int) -> bool:
+        page = self.pages.get(loc >> NODE_PAGE_BITS)
+        if not page: return False
+        offset = loc & REFCNT_PAGE_MASK
+        return (page[1][offset >> 3] >> (offset & 7)) & 1 == 1
+
+    def set_free(self, loc: int):
+        offset = loc & REFCNT_PAGE_MASK
+        self.page(loc)[1][offset >> 3] |= 1 << (offset & 7)
+
+    def incr(self, loc: int) -> int:
+        cnts = self.page(loc)[0]
+        offset = loc & REFCNT_PAGE_MASK
+        cnts[offset] += 1
+        return cnts[offset]
+
+    def decr(self, loc: int) -> int:
+        cnt = self.cnt(loc)
+        assert cnt > 0, f"decr loc {loc} cnt {cnt}"
+        cnts = self.pages[loc >> NODE_PAGE_BITS][0]
+        cnts[loc & REFCNT_PAGE_MASK] = cnt - 1
+        return cnt - 1
+
+    def incr_all(self, locs: list[int]):
+        for loc in locs:
+            self.page(loc)[0][loc & REFCNT_PAGE_MASK] += 1
+
+    # returns the locs whose count dropped to zero
+    def decr_all(self, locs: list[int]) -> list[int]:
+        return [loc for loc in locs if self.decr(loc) == 0]
+
+def term_locs(terms: Iterable[Term]) -> list[int]:
+    return [term.loc for term in terms if term.has_loc()]
+
+class RefCounter:
+    # term_at returns the term currently at a (node) loc; by default, that's
+    # the term of the node at that loc.
+    def __init__(self, term_at: Optional[Callable[[int], Optional[Term]]] = None):
+        self.node_index = NodeIndex()
+        self.term_at = term_at if term_at else self.node_term_at
+        self.refcnts = RefCounts()
+        self.booted = False
+        self.end_loc = 0
+        self.itr_locs: dict[int, Optional[int]] = {}
+        # neg locs of the nodes freed by the last process_itr_locs
+        self.freed: list[int] = []
+        self.logging = False
+
+    def log(self, msg: str):
+        if self.logging:
+            print(msg)
+
+    def add_itr_loc(self, nod_loc: int, trm_loc: Optional[int] = None):
+        if self.logging: self.log(f"adding itr_loc[{nod_loc}] = {trm_loc}")
+        self.itr_locs[nod_loc] = trm_loc
+
+    def node_term_at(self, loc: int) -> Optional[Term]:
+        node = self.node_index.node_at(loc)
+        return node.term_at(loc) if node else None
+
+    def is_neg_loc(self, loc: int) -> bool:
+        return (loc & 1) == 0
+
+    def neg_loc(self, loc: int) -> int:
+        return loc if self.is_neg_loc(loc) else loc - 1
+
+    def process_itr_locs(self):
+        refcnts = self.refcnts
+        self.freed = []
+        # neg locs of nodes that may have become free; a node can be on it
+        # more than once
+        work: list[int] = []
+        for nod_loc, trm_loc in self.itr_locs.items():
+            if refcnts.cnt(nod_loc) != 0:
+                continue
+            work.append(self.neg_loc(nod_loc))
+            if trm_loc and self.is_neg_loc(nod_loc):
+                work.append(self.neg_loc(trm_loc))
+
+        while work:
+            neg_loc = work.pop()
+            if refcnts.cnt(neg_loc) != 0 or refcnts.cnt(neg_loc + 1) != 0:
+                continue
+            if refcnts.is_free(neg_loc):
+                continue
+
+            if self.logging: self.log(f"freeing node @ {neg_loc}")
+            assert not refcnts.is_free(neg_loc + 1)
+            refcnts.set_free(neg_loc)
+            refcnts.set_free(neg_loc + 1)
+            self.freed.append(neg_loc)
+
+            for loc in (neg_loc, neg_loc + 1):
+                term = self.term_at(loc)
+                trm_loc = term.loc if term and term.has_loc() else None
+                if trm_loc and self.loc_decr(trm_loc, "process term"):
+                    work.append(self.neg_loc(trm_loc))
+        self.itr_locs = {}
+
+    def loc_incr(self, loc: int, src: str):
+        cnt = self.refcnts.incr(loc)
+        if self.logging: self.log(f"loc_incr loc {loc} to {cnt} from {src}")
+
+    def loc_decr(self, loc: int, src: str) -> bool:
+        cnt = self.refcnts.decr(loc)
+        if self.logging: self.log(f"loc_decr loc {loc} to {cnt} from {src}")
+        return cnt == 0
+
+    def term_incr(self, term: Term, src: str):
+        if term.has_loc():
+            self.loc_incr(term.loc, src)
+
+    def term_decr(self, term: Term, src: str):
+        if term.has_loc():
+            self.loc_decr(term.loc, src)
+
+    def redex_push(self, redex: Redex):
+        self.refcnts.incr_all(term_locs((redex.neg.term, redex.pos.term)))
+
+    def redex_pop(self, redex: Redex):
+        self.refcnts.decr_all(term_locs((redex.neg.term, redex.pos.term)))
+
+    def expand_ref(self, ref: ExpandRef):
+        for node in ref.nodes:
+            self.node_index.add(node)
+        self.refcnts.incr_all(term_locs(nod_trm.term for node in ref.nodes
+                                        for nod_trm in (node.neg, node.pos)))
+        if ref.nodes:
+            self.end_loc = ref.last_loc() + 1
+
+    def on_itr(self, itr: Interaction):
+        self.process_itr_locs()
+
+        if itr.memops: self.log("---on_itr---")
+
+        if itr.redex:
+            self.redex_pop(itr.redex)
+        if isinstance(itr, ExpandRef):
+            self.expand_ref(itr)
+        for redex in itr.redexes:
+            self.redex_push(redex)
+
+    def on_memop(self, memop: MemOp):
+        put = memop.put
+        if put:
+            self.term_incr(put, "put")
+            if self.refcnts.cnt(memop.loc) == 0:
+                self.add_itr_loc(memop.loc, put.loc if put.has_loc() else None)
+        got = memop.got
+        if got:
+            self.term_decr(got, "got")
+
+    def boot(self, term: Term):
+        assert not self.booted
+        self.term_incr(term, "boot")
+        self.booted = True
+
+NOT_FREED = -1
+
+# a node that isn't freed, though nothing reaches it
+UNREACHABLE = 'unreachable'
+# a node that's freed, though something still reaches it
+FREED_REACHABLE = 'freed_reachable'
+
+class Mismatch(NamedTuple):
+    itr_idx: int
+    # neg loc of the node
+    loc: int
+    kind: str
+
+# A SUB with a loc links the words of a multi-word MAT node, so it reaches the
+# node at that loc though it isn't a counted reference.
+def links_to(term: Term) -> bool:
+    return term.has_loc() or (term.tag == Tag.SUB and term.loc != 0)
+
+# The neg locs of the nodes reachable from roots, through the terms in node
+# memory. Only the reached nodes are kept, so tracing a small live set is
+# cheap however far apart the heap's nodes are.
+def reachable(roots: Iterable[Term], mem: dict[int, Term]) -> set[int]:
+    seen: set[int] = set()
+    stack = [term.loc for term in roots if links_to(term)]
+    while stack:
+        neg_loc = stack.pop() & ~1
+        if neg_loc in seen:
+            continue
+        seen.add(neg_loc)
+        for loc in (neg_loc, neg_loc + 1):
+            term = mem.get(loc)
+            if term and links_to(term):
+                stack.append(term.loc)
+    return seen
+
+# Liveness of every node in a model. Nodes are numbered in the order they're
+# created; ref_base has the number of the first node of each interaction that
+# created any (and -1 for those that didn't). When each node term is last
+# accessed is its InPlaceNodeTerm's last_access.
+@dataclass(eq=False)
+class Liveness:
+    ref_base: array = field(default_factory=lambda: array('i'))
+    # the interaction at whose start the node was freed. a node freed by the
+    # last interaction is freed at len(itrs); NOT_FREED if it never is.
+    node_free: array = field(default_factory=lambda: array('i'))
+    # from reachability snapshots, if any were taken. a node is reported
+    # once per kind, at the first snapshot that disagrees about it.
+    snapshots: int = 0
+    mismatches: list[Mismatch] = field(default_factory=list)
+
+    def node_num(self, node: Node) -> int:
+        return self.ref_base[node.ref.idx] + node.idx
+
+    def free_itr(self, node: Node) -> int:
+        return self.node_free[self.node_num(node)]
+
+# Replays a model's interactions through a RefCounter in order, one step at a
+# time, filling in a Liveness as it goes. analyze() runs one over a whole
+# model; the viewer steps one along with a lazy model, as its interactions
+# are linked. A node's free interaction is known once that interaction is
+# stepped.
+#
+# Node terms are mutated by the viewer as it executes memops, so the replay
+# keeps its own node memory, from the terms the memops store.
+#
+# With a stride, a reachability snapshot is taken at every stride-th
+# interaction, once its redexes are popped and pushed, as RefCounter.on_itr
+# counts them, and before its memops execute.
+# The roots are the boot term, the live redexes, and the popped redex, which
+# the interaction is still using.
+class Analysis:
+    def __init__(self, root: Term, stride: int = 0):
+        self.liveness = Liveness()
+        self.root = root
+        self.stride = stride
+        # interactions stepped so far
+        self.itr_count = 0
+        self.mem: dict[int, Term] = {}
+        self.counter = RefCounter(self.mem.get)
+        # for snapshots: neg locs of the nodes created so far, and redexes
+        # pushed but not popped
+        self.node_locs = array('I')
+        self.redexes: set[Redex] = set()
+        self.reported: set[tuple[int, str]] = set()
+        self.counter.boot(root)
+
+    def free(self, itr_idx: int):
+        liveness = self.liveness
+        node_index = self.counter.node_index
+        for neg_loc in self.counter.freed:
+            liveness.node_free[liveness.node_num(node_index.node_at(neg_loc))] = itr_idx
+
+    def snapshot(self, itr: Interaction):
+        liveness = self.liveness
+        roots = [self.root, itr.redex.neg.term, itr.redex.pos.term] if itr.redex else [self.root]
+        for redex in self.redexes:
+            roots += (redex.neg.term, redex.pos.term)
+        seen = reachable(roots, self.mem)
+        refcnts = self.counter.refcnts
+        for neg_loc in self.node_locs:
+            freed = refcnts.is_free(neg_loc)
+            if freed != (neg_loc in seen):
+                continue
+            kind = FREED_REACHABLE if freed else UNREACHABLE
+            if (neg_loc, kind) not in self.reported:
+                self.reported.add((neg_loc, kind))
+                liveness.mismatches.append(Mismatch(itr.idx, neg_loc, kind))
+        liveness.snapshots += 1
+
+    def step(self, itr: Interaction):
+        liveness = self.liveness
+        counter = self.counter
+        mem = self.mem
+        stride = self.stride
+        assert itr.idx == self.itr_count
+        self.itr_count += 1
+        if isinstance(itr, ExpandRef) and itr.nodes:
+            liveness.ref_base.append(len(liveness.node_free))
+            for node in itr.nodes:
+                liveness.node_free.append(NOT_FREED)
+                for nod_trm in (node.neg, node.pos):
+                    memops = nod_trm.memops
+                    mem[memops.loc(0)] = memops[0].put
+                if stride:
+                    self.node_locs.append(node.neg.mem_loc)
+        else:
+            liveness.ref_base.append(-1)
+        counter.on_itr(itr)
+        self.free(itr.idx)
+        if stride:
+            self.redexes.discard(itr.redex)
+            self.redexes.update(itr.redexes)
+            if itr.idx % stride == 0:
+                self.snapshot(itr)
+        for memop in itr.memops:
+            counter.on_memop(memop)
+            if memop.put:
+                mem[memop.loc] = memop.put
+
+    # frees what the last interaction left unreferenced
+    def finish(self) -> Liveness:
+        self.counter.process_itr_locs()
+        self.free(self.itr_count)
+        return self.liveness
+
+def analyze(root: Term, itrs: Sequence[Interaction], stride: int = 0) -> Liveness:
+    analysis = Analysis(root, stride)
+    for itr in itrs:
+        analysis.step(itr)
+    return analysis.finish()
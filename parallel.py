@@ -0,0 +1,352 @@
+from array import array
+from concurrent.futures import Executor, ProcessPoolExecutor
+import copy
+import os
+from typing import Iterator, Optional
+
+import cache
+from hvm import *
+from hvmb import COLUMNS, HVMB_EXT, read_hvmb
+from parse import (Linker, MemOpCounter, RedexBag, Step, ThreadBuilder, make_all,
+                   make_memop, pair_redexes, step_of)
+
+# Parallel parsing and linking.
+#
+# A text memlog is decoded into the table by worker processes, one range of
+# lines each. The table is then split into chunks at redex pops, at rows
+# where a thread starts a new interaction and no thread is half way through
+# pushing or popping a redex, and each chunk is linked by a worker as if it
+# were a whole memlog of its own, except that:
+#
+# - each thread's memops before its first pop in the chunk continue the
+#   interaction it had open at the end of the previous chunk. They are
+#   carried over to the parent unlinked.
+# - pops of redexes pushed in earlier chunks, and memops on nodes made in
+#   earlier chunks, are left unresolved.
+#
+# The parent stitches the linked chunks together in order. It appends each
+# chunk's interactions and redexes to the model, links the carried memops
+# by feeding them to each thread's builder where the previous chunk left it,
+# and resolves what the chunk left unresolved. Only memops near the start of
+# a chunk are linked by the parent.
+
+# Decoding
+
+def chunk_bounds(filename: str, num_chunks: int) -> list[tuple[int, int]]:
+    size = os.path.getsize(filename)
+    starts = [0]
+    with open(filename, 'rb') as f:
+        for i in range(1, num_chunks):
+            f.seek(size * i // num_chunks)
+            f.readline() # skip partial line
+            start = f.tell()
+            if start > starts[-1] and start < size:
+                starts.append(start)
+    return list(zip(starts, starts[1:] + [size]))
+
+def decode_chunk(filename: str, start: int, end: int) -> MemOpTable:
+    table = MemOpTable()
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        pos = start
+        seq = 0
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            line = line.strip()
+            if line:
+                table.append(make_memop(seq, line.decode().split(',')))
+                seq += 1
+    return table
+
+# Decodes a memlog into table, the lines of a text memlog in parallel.
+def decode(filename: str, table: MemOpTable, workers: int,
+           executor: Optional[Executor] = None):
+    if filename.endswith(HVMB_EXT):
+        read_hvmb(filename, table)
+        return
+    bounds = chunk_bounds(filename, workers)
+    starts, ends = zip(*bounds)
+    if executor:
+        chunks = executor.map(decode_chunk, [filename] * len(bounds), starts, ends)
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            chunks = list(executor.map(decode_chunk, [filename] * len(bounds), starts, ends))
+    for chunk in chunks:
+        table.extend(chunk)
+
+# Splitting
+
+@dataclass(eq=False)
+class Split:
+    # first row of the chunk, and its seq once redex pushes are paired
+    row: int
+    seq: int
+    # state of the redex bag at row
+    bag: RedexBag
+    # threads half way through pushing and popping a redex at row, and the
+    # row of the first half
+    pushes: dict[int, int]
+    pops: dict[int, int]
+
+# The table is split at the first pop at or after each of num_chunks even
+# splits of its rows.
+def split_rows(table: MemOpTable, num_chunks: int) -> list[Split]:
+    bag = RedexBag()
+    splits = [Split(0, 0, RedexBag(), {}, {})]
+    pushes: dict[int, int] = {}
+    pops: dict[int, int] = {}
+    # redex pushes paired so far
+    pairs = 0
+    size = len(table)
+    op_column = table.op
+    for row in range(size):
+        if op_column[row] == Op.EXCH:
+            continue
+        memop = table[row]
+        tid = memop.tid
+        if bag.is_push(memop):
+            if pushes.pop(tid, None) is None:
+                pushes[tid] = row
+            else:
+                pairs += 1
+        elif bag.is_pop(memop):
+            if pops.pop(tid, None) is not None:
+                continue
+            if row >= size * len(splits) // num_chunks:
+                splits.append(Split(row, row - pairs - len(pushes), copy.deepcopy(bag),
+                                    dict(pushes), dict(pops)))
+                if len(splits) == num_chunks:
+                    break
+            pops[tid] = row
+    return splits
+
+# The rows of the previous chunk that a chunk's first memops are paired with,
+# copied into a table of their own.
+def pending_rows(table: MemOpTable, split: Split) -> tuple[list[int], MemOpTable]:
+    rows = sorted(set(split.pushes.values()) | set(split.pops.values()))
+    pending = MemOpTable()
+    for name in COLUMNS:
+        column = getattr(table, name)
+        setattr(pending, name, array(column.typecode, [column[row] for row in rows]))
+    for name in ('itr', 'node_ref', 'node'):
+        setattr(pending, name, array('i', [-1]) * len(rows))
+    return rows, pending
+
+# Linking
+
+class ChunkLinker(Linker):
+    def __init__(self, table: MemOpTable, bag: RedexBag, first: bool,
+                 pops: dict[int, MemOp]):
+        super().__init__(table, bag)
+        self.redex_bldr.missing = []
+        self.unresolved: list[int] = []
+        # memops that continue interactions of the previous chunk; the first
+        # chunk has none
+        self.carry: Optional[list[MemOpBase]] = None if first else []
+        # the row at which each ref was added to refs
+        self.ref_rows: list[int] = []
+        # a thread that's half way through a pop starts its next interaction
+        # with the second half
+        for tid, fst in pops.items():
+            thread = self.thread(tid)
+            thread.fst = fst
+            thread.fst_step = Step.POP
+
+    def thread(self, tid: int) -> ThreadBuilder:
+        if tid not in self.threads:
+            super().thread(tid).itr_bldr.unresolved = self.unresolved
+        return self.threads[tid]
+
+    def add(self, memop: MemOpBase):
+        if (self.carry is not None and memop.tid not in self.threads and
+                step_of(self.bag, memop) != Step.POP):
+            self.carry.append(memop)
+            return
+        refs = len(self.refs)
+        super().add(memop)
+        if len(self.refs) > refs:
+            self.ref_rows.append(memop.idx)
+
+def link_chunk(columns: dict[str, array], row: int, seq: int, bag: RedexBag,
+               pending: tuple[list[int], MemOpTable], pushes: dict[int, int],
+               pops: dict[int, int]) -> dict:
+    table = MemOpTable()
+    for name, column in columns.items():
+        setattr(table, name, column)
+    size = len(table)
+    for name in ('itr', 'node_ref', 'node'):
+        setattr(table, name, array('i', [-1]) * size)
+
+    pending_rows, pending_table = pending
+    pending_idxs = {pending_row: idx for idx, pending_row in enumerate(pending_rows)}
+    def pending_memop(pending_row: int) -> MemOp:
+        return pending_table[pending_idxs[pending_row]]
+    def table_row(memop: MemOp) -> int:
+        return memop.idx + row if memop.table is table else pending_rows[memop.idx]
+
+    linker = ChunkLinker(table, bag, row == 0,
+                         {tid: pending_memop(fst) for tid, fst in pops.items()})
+    memops = MemOpCounter(pair_redexes(
+        map(table.__getitem__, range(size)), bag, seq,
+        {tid: pending_memop(neg) for tid, neg in pushes.items()}))
+    for memop in memops:
+        linker.add(memop)
+
+    # a popped redex pushed in an earlier chunk is found by its terms
+    missing = []
+    stand_ins = {id(redex) for redex in linker.redex_bldr.missing}
+    for itr in linker.itrs:
+        if id(itr.redex) in stand_ins:
+            missing.append((itr.idx, cache.flat_term(itr.redex.neg.term),
+                            cache.flat_term(itr.redex.pos.term)))
+            itr.redex = None
+
+    itrs, redexes = cache.flatten_itrs(linker.itrs, linker.redex_bldr.redexes, row)
+    threads = {}
+    for tid, thread in linker.threads.items():
+        threads[tid] = (
+            thread.ref_bldr.ref.idx if thread.ref_bldr.ref else -1,
+            thread.itr_bldr.itr.idx if thread.itr_bldr.itr else -1,
+            table_row(thread.fst) if thread.fst else -1,
+            thread.fst_step,
+            cache.flat_term(thread.root)
+        )
+    carry = []
+    for memop in linker.carry or ():
+        if isinstance(memop, Redex):
+            carry.append(tuple(table_row(stor) for stor in memop.stors))
+        else:
+            carry.append(memop.idx + row)
+    return {
+        'row': row,
+        'columns': {name: getattr(table, name) for name in ('seq', 'itr', 'node_ref', 'node')},
+        # pops of the previous chunk that this one finished
+        'pops': [(pending_rows[idx], itr) for idx, itr in enumerate(pending_table.itr) if itr >= 0],
+        'itrs': itrs,
+        'redexes': redexes,
+        'refs': [(ref_row + row, ref.idx) for ref_row, ref in zip(linker.ref_rows, linker.refs)],
+        'missing': missing,
+        'unresolved': [idx + row for idx in linker.unresolved],
+        'carry': carry,
+        'threads': threads,
+        'memop_count': memops.count
+    }
+
+# Stitching
+
+def shift_itrs(column: array, base: int) -> array:
+    return array('i', [idx + base if idx >= 0 else idx for idx in column])
+
+# memops linked out of row order, by stitching, are put back in order
+def sort_node_memops(table: MemOpTable, rows: list[int]):
+    node_terms = {}
+    for row in rows:
+        memop = table[row]
+        node = memop.node
+        if node:
+            node_term = node.get(memop.loc)
+            node_terms[id(node_term)] = node_term
+    for node_term in node_terms.values():
+        idxs = node_term.memops.idxs
+        if any(idxs[i] > idxs[i + 1] for i in range(len(idxs) - 1)):
+            idxs[:] = array('I', sorted(idxs))
+
+def stitch(linker: Linker, table: MemOpTable, chunk: dict):
+    itrs = linker.itrs
+    redexes = linker.redex_bldr.redexes
+    itr_base, redex_base = len(itrs), len(redexes)
+    cache.unflatten_itrs(chunk['itrs'], chunk['redexes'], table, itrs, redexes)
+
+    row = chunk['row']
+    columns = chunk['columns']
+    end = row + len(columns['seq'])
+    table.seq[row:end] = columns['seq']
+    table.itr[row:end] = shift_itrs(columns['itr'], itr_base)
+    table.node_ref[row:end] = shift_itrs(columns['node_ref'], itr_base)
+    table.node[row:end] = columns['node']
+    for (fst, itr) in chunk['pops']:
+        table.itr[fst] = itr + itr_base
+
+    for redex in redexes[redex_base:]:
+        if redex.neg.term.has_loc() or redex.pos.term.has_loc():
+            linker.redex_bldr.redex_map[(redex.neg.term, redex.pos.term)] = redex
+    refs = []
+    for ref_row, idx in chunk['refs']:
+        ref = itrs[itr_base + idx]
+        refs.append((ref_row, ref))
+        for node in ref.nodes:
+            linker.node_index.add(node)
+
+    # each thread carries on from where it was at the end of the last chunk
+    carried = []
+    for memop in chunk['carry']:
+        if isinstance(memop, tuple):
+            # a redex push whose first half may be in the previous chunk
+            neg, pos = memop
+            table.seq[neg] = table.seq[pos]
+            memop = Redex.new(table[neg], table[pos])
+        else:
+            carried.append(memop)
+            memop = table[memop]
+        ref_count = len(linker.refs)
+        linker.add(memop)
+        refs.extend((memop.idx, ref) for ref in linker.refs[ref_count:])
+        del linker.refs[ref_count:]
+    # refs are in the order they were added, as when linking sequentially
+    refs.sort(key=lambda row_ref: row_ref[0])
+    linker.refs.extend(ref for (_, ref) in refs)
+
+    for idx in chunk['unresolved']:
+        memop = table[idx]
+        node = linker.node_index.node_at(memop.loc)
+        memop.node = node
+        node.get(memop.loc).memops.append(memop)
+    for (idx, neg, pos) in chunk['missing']:
+        itrs[itr_base + idx].redex = linker.redex_bldr.redex_map[
+            (cache.make_term(neg), cache.make_term(pos))]
+    sort_node_memops(table, carried + chunk['unresolved'])
+
+    for tid, (ref, itr, fst, fst_step, root) in chunk['threads'].items():
+        thread = linker.thread(tid)
+        thread.ref_bldr.ref = itrs[itr_base + ref] if ref >= 0 else None
+        thread.itr_bldr.itr = itrs[itr_base + itr] if itr >= 0 else None
+        thread.fst = table[fst] if fst >= 0 else None
+        thread.fst_step = fst_step
+        if root:
+            thread.root = cache.make_term(root)
+
+def link_parallel(filename: str, workers: int) -> Model:
+    table = MemOpTable()
+    with ProcessPoolExecutor(workers) as executor:
+        decode(filename, table, workers, executor)
+        splits = split_rows(table, workers)
+        if len(splits) == 1:
+            bag = RedexBag()
+            memops = MemOpCounter(pair_redexes(map(table.__getitem__, range(len(table))), bag))
+            return Model(*make_all(memops, table, bag), table, memops.count)
+
+        ends = [split.row for split in splits[1:]] + [len(table)]
+        def columns() -> Iterator[dict[str, array]]:
+            for split, end in zip(splits, ends):
+                yield {name: getattr(table, name)[split.row:end] for name in COLUMNS}
+        chunks = executor.map(
+            link_chunk, columns(),
+            [split.row for split in splits], [split.seq for split in splits],
+            [split.bag for split in splits],
+            [pending_rows(table, split) for split in splits],
+            [split.pushes for split in splits], [split.pops for split in splits])
+        # carried memops are never pops, so the parent needs no redex bag
+        linker = Linker(table, RedexBag())
+        memop_count = 0
+        for chunk in chunks:
+            stitch(linker, table, chunk)
+            memop_count += chunk['memop_count']
+
+    # carried redexes are pushed after the rest of their chunk's
+    linker.redex_bldr.redexes.sort(key=lambda redex: redex.seq)
+    set_last_access(linker.itrs, table)
+    return Model(linker.root(), linker.itrs, linker.refs, linker.redex_bldr.redexes,
+                 table, memop_count)
@@ -1,47 +1,54 @@
-from collections import deque
+import argparse
+from array import array
+from enum import IntEnum
 import sys
+import time
 import traceback
+from typing import Callable, Iterable, Iterator
 
+import cache
 from hvm import *
-from vis import event_loop
+from hvmb import HVMB_EXT, read_hvmb
+from liveness import analyze
 
 TermMap = dict[Term, NodeTerm]
 
 log = False
 
-def make_memop(seq: int, parts: list[str]) -> MemOpBase:
+def make_memop(seq: int, parts: list[str]) -> MemOpFields:
     assert len(parts) >= 7
-    # Extract basic fields (ignoring counter at index 0)
+    # Extract basic fields
+    ts = int(parts[0])
     tid = int(parts[1])
-    itr_name = parts[2]
-    op = parts[3].strip()
+    itr_name = ITRS[parts[2]]
+    op = OPS[parts[3].strip()]
     lvl = int(parts[4])
     #lab = 0
 
     # Parse terms based on operation type
-    if op == 'STOR':
+    if op == Op.STOR:
         # STOR: put term only
-        put_tag = parts[5]
+        put_tag = TAGS[parts[5]]
         put_loc = int(parts[6])
         put = Term(put_tag, 0, put_loc)
         got = None
         loc = int(parts[7])
 
-    elif op == 'LOAD' or op == 'POP':
+    elif op == Op.LOAD or op == Op.POP:
         # POP: got term only
-        got_tag = parts[5]
+        got_tag = TAGS[parts[5]]
         got_loc = int(parts[6])
         got = Term(got_tag, 0, got_loc)
         put = None
         loc = int(parts[7])
 
-    elif op == 'EXCH':
+    elif op == Op.EXCH:
         # EXCH format: counter,thread,itr_name,EXCH,lvl,got_tag,got_loc,put_tag,put_loc,loc
-        got_tag = parts[5]
+        got_tag = TAGS[parts[5]]
         got_loc = int(parts[6])
         got = Term(got_tag, 0, got_loc)
 
-        put_tag = parts[7]
+        put_tag = TAGS[parts[7]]
         put_loc = int(parts[8])
         put = Term(put_tag, 0, put_loc)
 
@@ -50,57 +57,102 @@ def make_memop(seq: int, parts: list[str]) -> MemOpBase:
     else:
         assert False, f"{op}"
         
-    return MemOp(
+    return MemOpFields(
         seq = seq,
         tid = tid,
         itr_name = itr_name,
         op = op,
         lvl = lvl,
-        put = put,
         got = got,
-        loc = loc
-    )
-
-def is_redex_push(memop: MemOpBase) -> bool:
-    # Arbitrary limit here will bite me eventually
-    # only works with TPC = 1. more threads means node address may be larger.
-    return (
-        memop.op == 'STOR' and
-        memop.loc > 100000
-    )
-
-def is_redex_pop(memop: MemOpBase) -> bool:
-    # Arbitrary limit here will bite me eventually
-    # only works with TPC = 1. more threads means node address may be larger.
-    return (
-        memop.op in ('LOAD', 'POP') and
-        memop.loc > 100000
-    )
-
-def is_node_store(memop: MemOpBase) -> bool:
-    return (
-        memop.op == 'STOR' and
-        (memop.is_root_itr() or memop.is_appref_itr()) and
-        not is_redex_push(memop)
+        put = put,
+        loc = loc,
+        ts = ts
     )
 
-def ref_from_loc(refs: list[ExpandRef], loc: int):
-    for ref in refs:
-        if ref.contains(loc):
-            return ref
-    if log: print(f"No ref for loc {loc} len(refs) {len(refs)}")
-
-    return None
-
-def node_from_loc(refs: list[ExpandRef], loc: int):
-    ref = ref_from_loc(refs, loc)
-    if not ref: return None
-    for node in ref.nodes:
-        node_loc = node.neg.mem_loc
-        if loc in (node_loc, node_loc + 1):
-            return node
-    if log: print(f"No node for loc {loc} len(ref.nodes) {len(ref.nodes)}")
-    return None
+# Locates each thread's redex bag from the trace, rather than assuming every
+# loc above some fixed address is in it.
+#
+# A thread only pushes to its own bag, so the bag is located at the thread's
+# first push. Until then, its STORs are either node stores or that push, and
+# node memory is bump allocated, so each node store continues the thread's
+# node allocation and the first one that doesn't is the push. (A thread's
+# first STOR, if it could be a node store at all, is taken to be one: an
+# expansion stores its nodes before it pushes any redexes.) From then on the
+# bag's extent grows as redexes are pushed one past its current top.
+#
+# A STOR that would locate a bag but falls in node memory some thread has
+# already stored nodes in can't be a push; it's reported, and the bag is
+# located at a later STOR. One that falls in another thread's bag is refused.
+@dataclass(eq=False)
+class RedexBag:
+    # [lo, hi] loc range of each thread's bag
+    ranges: dict[int, list[int]] = field(default_factory=dict)
+    # loc after each thread's last node store, until its bag is located
+    heap_tops: dict[int, int] = field(default_factory=dict)
+    # [lo, hi) loc range each thread's expansions have stored nodes in
+    heaps: dict[int, list[int]] = field(default_factory=dict)
+
+    def _add_node_store(self, memop: MemOpBase):
+        heap = self.heaps.get(memop.tid)
+        if heap:
+            heap[0] = min(heap[0], memop.loc)
+            heap[1] = max(heap[1], memop.loc + 1)
+        else:
+            self.heaps[memop.tid] = [memop.loc, memop.loc + 1]
+
+    def _locate(self, memop: MemOpBase) -> bool:
+        tid = memop.tid
+        top = self.heap_tops.get(tid)
+        if top is None:
+            is_node = (memop.is_root_itr() or memop.is_appref_itr() or
+                       (memop.is_matnum_itr() and memop.put.has_num_tag()))
+        else:
+            is_node = memop.loc == top
+        if is_node:
+            self.heap_tops[tid] = memop.loc + 1
+            self._add_node_store(memop)
+            return False
+        loc = memop.loc
+        if any(lo <= loc < hi for lo, hi in self.heaps.values()):
+            print(f"Warning: thread {tid} {itr_str(memop.itr_name)} STOR @ {loc} is in node memory, "
+                  f"so it isn't the push that locates the thread's redex bag", file=sys.stderr)
+            return False
+        for other, (lo, hi) in self.ranges.items():
+            assert not lo <= loc <= hi, f"thread {tid}'s first push @ {loc} is in thread {other}'s redex bag"
+        if log: print(f"thread {tid} redex bag @ {loc}")
+        self.heap_tops.pop(tid, None)
+        self.ranges[tid] = [loc, loc]
+        return True
+
+    def is_push(self, memop: MemOpBase) -> bool:
+        # loc 0 is the root term
+        if memop.op != Op.STOR or memop.loc == 0:
+            return False
+        bag = self.ranges.get(memop.tid)
+        if not bag:
+            return self._locate(memop)
+        if not bag[0] <= memop.loc <= bag[1] + 1:
+            if memop.is_appref_itr() or memop.is_matnum_itr() or memop.is_root_itr():
+                self._add_node_store(memop)
+            return False
+        bag[1] = max(bag[1], memop.loc)
+        return True
+
+    def is_pop(self, memop: MemOpBase) -> bool:
+        if not (READ_MASK >> memop.op) & 1:
+            return False
+        # redexes may be popped (stolen) from another thread's bag
+        bag = self.ranges.get(memop.tid)
+        if bag and bag[0] <= memop.loc <= bag[1]:
+            return True
+        return any(lo <= memop.loc <= hi for lo, hi in self.ranges.values())
+
+    def is_node_store(self, memop: MemOpBase) -> bool:
+        # pushes were already paired into Redexes (op PUSH) by pair_redexes
+        return (
+            memop.op == Op.STOR and
+            (memop.is_root_itr() or memop.is_appref_itr())
+        )
 
 @dataclass(eq=False)
 class RedexBuilder:
@@ -108,6 +160,9 @@ class RedexBuilder:
     refs: list[ExpandRef]
     redexes: list[Redex] = field(default_factory=list)
     redex_map: dict[tuple[Term, Term], Redex] = field(default_factory=dict)
+    # when linking one chunk of a memlog, a stand-in for each popped redex
+    # that was pushed in an earlier chunk
+    missing: Optional[list[Redex]] = None
 
     """
     def get_node_term(self, term: Term):
@@ -128,6 +183,10 @@ class RedexBuilder:
 
     def push(self, redex: Redex, itr: Interaction):
         redex._init_itr(redex, itr)
+        # the push's rows belong to the interaction that pushed it
+        for stor in redex.stors:
+            stor.itr = itr
+        redex.stors = ()
         # TODO: terms emergent in code, terms from non-visible refs
         itr.redexes.append(redex)
 
@@ -142,9 +201,21 @@ class RedexBuilder:
             self.redex_map[key] = redex
 
     def pop(self, neg_op: MemOp, pos_op: MemOp) -> Optional[Redex]:
-        # this is basically a way of ignoring ERA~REFs
-        if neg_op.got.has_loc() or pos_op.got.has_loc():
-            popped = self.redex_map[(neg_op.got, pos_op.got)]
+        if pops_redex(neg_op, pos_op):
+            key = (neg_op.got, pos_op.got)
+            if self.missing is not None and key not in self.redex_map:
+                popped = Redex(
+                    seq = -1,
+                    tid = neg_op.tid,
+                    itr_name = neg_op.itr_name,
+                    op = Op.PUSH,
+                    loc = neg_op.loc,
+                    neg = NodeTerm(neg_op.got),
+                    pos = NodeTerm(pos_op.got)
+                )
+                self.missing.append(popped)
+                return popped
+            popped = self.redex_map[key]
             if log: print(f"popped {popped}")
             return popped
         else:
@@ -156,7 +227,10 @@ class RefBuilder:
     term_map: TermMap
     itrs: list[Interaction]
     refs: list[ExpandRef]
+    node_index: NodeIndex
     ref: Optional[ExpandRef] = None
+    # when linking lazily, what's known about memops not linked yet
+    index: Optional['ItrIndex'] = None
 
     """
     def add_node_term(self, node_term: NodeTerm):
@@ -176,6 +250,11 @@ class RefBuilder:
         neg.node = node
         pos.node = node
         self.ref.add_node(node)
+        self.node_index.add(node)
+        if self.index:
+            for nod_trm in (neg, pos):
+                self.index.track(nod_trm)
+                self.ref.last_access = max(self.ref.last_access, nod_trm.last_access)
         if log: print(f"added node: {len(self.ref.nodes)}")
 
     def new(self, redex: Redex, loc: Optional[int] = None):
@@ -199,8 +278,8 @@ class RefBuilder:
             #    InPlaceNodeTerm(EMPTY_TERM))
 
         if log: print(f"adding node: {fst.put} {snd.put} @ {fst.loc}")
-        neg = InPlaceNodeTerm(fst.put, memops=[fst])
-        pos = InPlaceNodeTerm(snd.put, memops=[snd])
+        neg = InPlaceNodeTerm(fst.put, memops=MemOpList.of(fst))
+        pos = InPlaceNodeTerm(snd.put, memops=MemOpList.of(snd))
         self.add_new_node(neg, pos)
         """
         self.add_node_term(neg)
@@ -218,20 +297,23 @@ class ItrBuilder:
     term_map: TermMap
     itrs: list[Interaction]
     refs: list[ExpandRef]
+    node_index: NodeIndex
     itr: Optional[Interaction] = None
+    # when linking one chunk of a memlog, rows at nodes made in earlier chunks
+    unresolved: Optional[list[int]] = None
 
     # TODO: Interaction.new(itr_name, redex)
-    def make_itr(self, itr_name: str, redex: Redex):
+    def make_itr(self, itr_name: int, redex: Redex):
         match itr_name:
-            case AppLam.NAME: return AppLam(redex, len(self.itrs))
-            case MatRef.NAME: return MatRef(redex, len(self.itrs))
-            case MatU32.NAME: return MatU32(redex, len(self.itrs))
-            case OpxU32.NAME: return OpxU32(redex, len(self.itrs))
-            case OpyU32.NAME: return OpyU32(redex, len(self.itrs))
-            case DupU32.NAME: return DupU32(redex, len(self.itrs))
-            case _: raise RuntimeError(f"{redex.itr_name}")
-
-    def new(self, redex: Redex, itr_name: str):
+            case Itr.APPLAM: return AppLam(redex, len(self.itrs))
+            case Itr.MATREF: return MatRef(redex, len(self.itrs))
+            case Itr.MATU32: return MatU32(redex, len(self.itrs))
+            case Itr.OPXU32: return OpxU32(redex, len(self.itrs))
+            case Itr.OPYU32: return OpyU32(redex, len(self.itrs))
+            case Itr.DUPU32: return DupU32(redex, len(self.itrs))
+            case _: raise RuntimeError(f"{itr_str(redex.itr_name)}")
+
+    def new(self, redex: Redex, itr_name: int):
         assert not self.itr
         self.itr = self.make_itr(itr_name, redex)
         self.itrs.append(self.itr)
@@ -254,12 +336,16 @@ class ItrBuilder:
             #    node_term = self.term_map[memop.put]
             #    node_term.stores.append(memop)
         """
-        node = node_from_loc(self.refs, memop.loc)
-        memop.node = node
         memop.itr = self.itr
+        self.itr.memops.append(memop)
+        node = self.node_index.node_at(memop.loc)
+        if not node and self.unresolved is not None:
+            self.unresolved.append(memop.idx)
+            return
+        if log and not node: print(f"No node for loc {memop.loc}")
+        memop.node = node
         node_term = node.get(memop.loc)
         node_term.memops.append(memop)
-        self.itr.memops.append(memop)
 
     def done(self):
         if self.itr:
@@ -267,113 +353,512 @@ class ItrBuilder:
             if log: print(f"done, itr {self.itr.name()} {self.itr.redex} ops {len(self.itr.memops)}")
             self.itr = None
 
-def parse_memops(file_content: str) -> list[MemOpBase]:
-    filtered = []
-    lines = file_content.strip().split('\n')
-    for line in lines:
-        if line.strip():
-            filtered.append(line)
-
-    memops: list[MemOpBase] = []
-    lines_que = deque(filtered)
-    while lines_que:
-        line = lines_que.popleft()
-        memop = make_memop(len(memops), line.split(','))
-        if not is_redex_push(memop):
-            memops.append(memop)
+def iter_lines(filename: str) -> Iterator[str]:
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+def parse_lines(lines: Iterable[str]) -> Iterator[MemOpFields]:
+    for seq, line in enumerate(lines):
+        yield make_memop(seq, line.split(','))
+
+# Pairs each redex push (two STORs by the same thread) into a single Redex as
+# memops are read, so only the current memop is ever held in memory.
+def pair_redexes(memops: Iterable[MemOp], bag: RedexBag, seq: int = 0,
+                 pushes: Optional[dict[int, MemOp]] = None) -> Iterator[MemOpBase]:
+    # first half of a redex push, by thread
+    pushes = dict(pushes) if pushes else {}
+    for memop in memops:
+        if bag.is_push(memop):
+            neg = pushes.pop(memop.tid, None)
+            if not neg:
+                pushes[memop.tid] = memop
+                continue
+            neg.seq = seq
+            memop.seq = seq
+            memop = Redex.new(neg, memop)
         else:
-            line = lines_que.popleft()
-            redex = Redex.new(memop, make_memop(len(memops), line.split(',')))
-            memops.append(redex)
-
-    return memops
+            memop.seq = seq
+        yield memop
+        seq += 1
+
+def iter_memops(filename: str, table: MemOpTable, bag: RedexBag) -> Iterator[MemOpBase]:
+    if filename.endswith(HVMB_EXT):
+        # the whole table is loaded at once; pair over views of its rows
+        first = len(table)
+        read_hvmb(filename, table)
+        views = map(table.__getitem__, range(first, len(table)))
+        return pair_redexes(views, bag)
+    fields = parse_lines(iter_lines(filename))
+    return pair_redexes((table.append(memop) for memop in fields), bag)
+
+# What ThreadBuilder.add does with a memop that isn't the second half of a
+# pair. ItrIndex finds interaction boundaries by the same rules.
+class Step(IntEnum):
+    ROOT        = 0 # stores the root term
+    NODE_STORE  = 1 # first half of a node store
+    PUSH        = 2 # a paired redex push
+    POP         = 3 # first half of a redex pop
+    MATNUM_NODE = 4 # first half of a node a MATNUM creates
+    MEMOP       = 5 # the "meat" of an interaction
+
+def step_of(bag: RedexBag, fst: MemOpBase) -> Step:
+    if bag.is_node_store(fst):
+        # special ha(ck)ndling for root node
+        if fst.loc == 0:
+            return Step.ROOT
+        return Step.NODE_STORE
+    if fst.op == Op.PUSH:
+        return Step.PUSH
+    if bag.is_pop(fst):
+        return Step.POP
+    # if a MATNUM is STORing a NUM, it is a new node that it has created
+    if fst.is_matnum_itr() and fst.op == Op.STOR and fst.put.has_num_tag():
+        return Step.MATNUM_NODE
+    return Step.MEMOP
+
+# this is basically a way of ignoring ERA~REFs, which don't make an interaction
+def pops_redex(neg_op: MemOp, pos_op: MemOp) -> bool:
+    return neg_op.got.has_loc() or pos_op.got.has_loc()
 
-def make_all(memops: list[MemOpBase]) -> tuple[Term, list[ExpandRef],
-                                          list[Interaction], list[Redex]]:
-    term_map: TermMap = {}
-    itrs: list[Interaction] = []
-    refs: list[ExpandRef] = []
+@dataclass(eq=False)
+class MemOpCounter:
+    memops: Iterable[MemOpBase]
+    count: int = 0
+
+    def __iter__(self) -> Iterator[MemOpBase]:
+        for memop in self.memops:
+            self.count += 1
+            yield memop
+
+# Builds the interactions of one thread. The memops of a thread are in order
+# in the log, but may be interleaved with those of other threads, so memops
+# that come in pairs (node stores, redex pops) are paired up per thread.
+@dataclass(eq=False)
+class ThreadBuilder:
+    bag: RedexBag
+    redex_bldr: RedexBuilder
+    ref_bldr: RefBuilder
+    itr_bldr: ItrBuilder
     root: Optional[Term] = None
-
-    redex_bldr = RedexBuilder(term_map, refs)
-    ref_bldr = RefBuilder(term_map, itrs, refs)
-    itr_bldr = ItrBuilder(term_map, itrs, refs)
-
-    ops_que = deque(memops)
-
-    while ops_que:
-        fst = ops_que.popleft()
-        if is_node_store(fst):
-            # special ha(ck)ndling for root node
-            if fst.loc == 0:
-                assert fst.is_root_itr() and not root
-                root = fst.put
-            else:
-                snd = ops_que.popleft()
-                ref_bldr.add(fst, snd)
-            continue
-
-        if fst.op == 'PUSH':
-            psh_itr = ref_bldr.ref if ref_bldr.ref else itr_bldr.itr
-            redex_bldr.push(fst, psh_itr)
-            continue
+    # first memop of a pair, and its step
+    fst: Optional[MemOp] = None
+    fst_step: Optional[Step] = None
+
+    def add(self, fst: MemOpBase):
+        if self.fst:
+            on_snd = self.on_snd(self.fst_step)
+            snd, fst = fst, self.fst
+            self.fst = self.fst_step = None
+            on_snd(fst, snd)
+            return
+
+        step = step_of(self.bag, fst)
+        if step == Step.ROOT:
+            assert fst.is_root_itr() and not self.root
+            self.root = fst.put
+            return
+        if step == Step.NODE_STORE:
+            self.pair(fst, step)
+            return
+        if step == Step.PUSH:
+            psh_itr = self.ref_bldr.ref if self.ref_bldr.ref else self.itr_bldr.itr
+            self.redex_bldr.push(fst, psh_itr)
+            return
 
         # i guess a ref only contains node stores and redex pushes?
-        ref_bldr.done()
-
-        if is_redex_pop(fst):
-            itr_bldr.done()
-            snd = ops_que.popleft()
-            assert fst.itr_name == snd.itr_name
-            redex = redex_bldr.pop(fst, snd)
-            if not redex: continue
-            if fst.is_appref_itr():
-                ref_bldr.new(redex)
-            else:
-                itr_bldr.new(redex, fst.itr_name)
-            continue
-
-        if log: print(f"{fst}")
+        self.ref_bldr.done()
 
-        # if a MATNUM is STORing a NUM, it is a new node that it has created
-        if fst.is_matnum_itr() and fst.op == 'STOR' and fst.put.has_num_tag():
-            snd = ops_que.popleft()
-            itr_bldr.itr.def_idx = DefIdx.MAT + fst.loc
-            ref_bldr.hijack(itr_bldr.itr)
-            ref_bldr.add(fst, snd)
-            ref_bldr.done()
-            continue
-
-        # at this point, it should just a "normal" memory operation, i.e., the
-        # "meat" of an interaction.
-        itr_bldr.add(fst)
-
-    return (root, itr_bldr.itrs, refs, redex_bldr.redexes)
+        if step == Step.POP:
+            self.itr_bldr.done()
+            self.pair(fst, step)
+        elif step == Step.MATNUM_NODE:
+            self.pair(fst, step)
+        else:
+            if log: print(f"{fst}")
+            self.itr_bldr.add(fst)
+
+    def pair(self, fst: MemOp, step: Step):
+        self.fst = fst
+        self.fst_step = step
+
+    # what to do once the second memop of a pair is seen
+    def on_snd(self, step: Step) -> Callable[[MemOp, MemOp], None]:
+        match step:
+            case Step.NODE_STORE: return self.ref_bldr.add
+            case Step.POP: return self.pop
+            case Step.MATNUM_NODE: return self.matnum_node
+
+    def pop(self, fst: MemOp, snd: MemOp):
+        assert fst.itr_name == snd.itr_name
+        redex = self.redex_bldr.pop(fst, snd)
+        if not redex: return
+        if fst.is_appref_itr():
+            self.ref_bldr.new(redex)
+            itr = self.ref_bldr.ref
+        else:
+            self.itr_bldr.new(redex, fst.itr_name)
+            itr = self.itr_bldr.itr
+        # the pop's rows belong to the interaction that consumes it
+        fst.itr = itr
+        snd.itr = itr
+
+    def matnum_node(self, fst: MemOp, snd: MemOp):
+        self.itr_bldr.itr.def_idx = DefIdx.MAT + fst.loc
+        self.ref_bldr.hijack(self.itr_bldr.itr)
+        self.ref_bldr.add(fst, snd)
+        self.ref_bldr.done()
+
+# Memops are demultiplexed by thread id into a ThreadBuilder per thread. They
+# share the interaction and ref lists, node memory and the redex map, since
+# terms and redexes can move between threads; so they are fed in log order.
+class Linker:
+    def __init__(self, table: MemOpTable, bag: RedexBag,
+                 index: Optional['ItrIndex'] = None):
+        self.bag = bag
+        self.term_map: TermMap = {}
+        # MemOp views resolve their interaction index through the table
+        self.itrs: list[Interaction] = table.itrs
+        self.refs: list[ExpandRef] = []
+        self.node_index = NodeIndex()
+        self.index = index
+        self.redex_bldr = RedexBuilder(self.term_map, self.refs)
+        self.threads: dict[int, ThreadBuilder] = {}
+
+    def thread(self, tid: int) -> ThreadBuilder:
+        thread = self.threads.get(tid)
+        if not thread:
+            thread = ThreadBuilder(
+                self.bag, self.redex_bldr,
+                RefBuilder(self.term_map, self.itrs, self.refs, self.node_index,
+                           index=self.index),
+                ItrBuilder(self.term_map, self.itrs, self.refs, self.node_index))
+            self.threads[tid] = thread
+        return thread
+
+    def add(self, memop: MemOpBase):
+        self.thread(memop.tid).add(memop)
+
+    def root(self) -> Optional[Term]:
+        roots = [thread.root for thread in self.threads.values() if thread.root]
+        assert len(roots) <= 1
+        return roots[0] if roots else None
+
+def make_all(memops: Iterable[MemOpBase], table: MemOpTable,
+             bag: RedexBag) -> tuple[Term, list[Interaction], list[ExpandRef], list[Redex]]:
+    linker = Linker(table, bag)
+    for memop in memops:
+        linker.add(memop)
+    set_last_access(linker.itrs, table)
+    return (linker.root(), linker.itrs, linker.refs, linker.redex_bldr.redexes)
+
+# Lazy linking. An index pass decodes the memlog into the table and finds the
+# row each interaction starts at, the number of memops at each loc and the
+# last access of each loc, without building any objects; it classifies memops
+# with the same step_of as ThreadBuilder, so it finds the same interactions.
+# Interactions (and the refs, nodes and redexes they create) are then linked
+# in order, only as far as the viewer has asked for.
+#
+# The index is built incrementally too: linking an interaction only indexes
+# the log as far as the end of that interaction, so opening the viewer reads
+# just the start of the log, and the viewer indexes the rest a little each
+# frame. Whether a node term is done depends on its last access, which can
+# be anywhere later in the log, so the node terms linked before the whole log
+# is indexed have UNKNOWN_ACCESS until it is; their memop counts grow as
+# their memops are indexed.
+#
+# Node memory is bump allocated (a loc is never reused by another node) so
+# the count at a node term's loc is the number of memops it will have once
+# everything is linked, which is what tells whether the term is done.
+
+# the end of an interaction whose thread hasn't started its next one yet
+OPEN_END = 0xFFFFFFFF
 
-def parse_file(filename: str) -> list[MemOpBase]:
+@dataclass(eq=False)
+class ItrIndex:
+    # the memops not indexed yet; None once the whole log is
+    memops: Optional[Iterator[MemOpBase]]
+    bag: RedexBag
+    # table row that each interaction starts at, and its thread's last row
+    # before its next interaction. interactions of different threads overlap.
+    offsets: array = field(default_factory=lambda: array('I'))
+    ends: array = field(default_factory=lambda: array('I'))
+    loc_counts: dict[int, int] = field(default_factory=dict)
+    # access_key of the last memop at each loc that isn't a node store
+    last_access: dict[int, int] = field(default_factory=dict)
+    # memops after redex pushes are paired
+    memop_count: int = 0
+    # per thread, as in ThreadBuilder: the first memop of a pair and its
+    # step, whether a ref is open, the interaction its memops are in, and the
+    # last row it was seen at
+    pairs: dict[int, tuple[MemOpBase, Step]] = field(default_factory=dict)
+    refs: set[int] = field(default_factory=set)
+    open_itrs: dict[int, int] = field(default_factory=dict)
+    last_rows: dict[int, int] = field(default_factory=dict)
+    # node terms linked before the whole log is indexed, by loc
+    terms: dict[int, InPlaceNodeTerm] = field(default_factory=dict)
+
+    def _start(self, tid: int, row: int):
+        self.open_itrs[tid] = len(self.offsets)
+        self.offsets.append(row)
+        self.ends.append(OPEN_END)
+
+    def _end(self, tid: int):
+        if tid in self.open_itrs:
+            self.ends[self.open_itrs.pop(tid)] = self.last_rows[tid]
+
+    def _add(self, memop: MemOpBase):
+        self.memop_count += 1
+        tid = memop.tid
+        if isinstance(memop, Redex):
+            self.last_rows[tid] = memop.stors[-1].idx
+            return
+
+        pairs = self.pairs
+        refs = self.refs
+        if tid in pairs:
+            fst, step = pairs.pop(tid)
+            if step == Step.POP and pops_redex(fst, memop):
+                self._start(tid, fst.idx)
+                if fst.is_appref_itr():
+                    refs.add(tid)
+            elif step == Step.NODE_STORE and tid not in refs:
+                # boot ref
+                refs.add(tid)
+                self._start(tid, fst.idx)
+        else:
+            step = step_of(self.bag, memop)
+            if step == Step.NODE_STORE:
+                pairs[tid] = (memop, step)
+            elif step != Step.ROOT:
+                refs.discard(tid)
+                if step == Step.POP:
+                    self._end(tid)
+                if step in (Step.POP, Step.MATNUM_NODE):
+                    pairs[tid] = (memop, step)
+
+        # node memory is bump allocated, so the first memop at a loc is the
+        # store that creates its node. bag locs are counted too, harmlessly.
+        loc = memop.loc
+        count = self.loc_counts.get(loc, 0)
+        self.loc_counts[loc] = count + 1
+        if count and tid in self.open_itrs:
+            self.last_access[loc] = access_key(self.open_itrs[tid], memop.idx)
+        nod_trm = self.terms.get(loc)
+        if nod_trm:
+            nod_trm.last_idx = count
+            nod_trm.node.ref.version += 1
+        self.last_rows[tid] = memop.idx
+
+    # Indexes up to count more memops; False once the whole log is indexed.
+    def extend(self, count: int) -> bool:
+        if self.memops is None:
+            return False
+        for _ in range(count):
+            memop = next(self.memops, None)
+            if memop is None:
+                self._finish()
+                return False
+            self._add(memop)
+        return True
+
+    def _finish(self):
+        self.memops = None
+        for tid in list(self.open_itrs):
+            self._end(tid)
+        refs = {}
+        for loc, nod_trm in self.terms.items():
+            nod_trm.last_access = self.last_access.get(loc, 0)
+            refs[id(nod_trm.node.ref)] = nod_trm.node.ref
+        for ref in refs.values():
+            ref.last_access = max(nod_trm.last_access for node in ref.nodes
+                                  for nod_trm in (node.neg, node.pos))
+            ref.version += 1
+        self.terms = {}
+
+    # Indexes until interaction idx has ended, and whether there's an
+    # interaction after it is known.
+    def index_to(self, idx: int):
+        while self.memops and (len(self.offsets) <= idx + 1 or self.ends[idx] == OPEN_END):
+            self.extend(1)
+
+    def index_all(self):
+        while self.extend(1 << 16):
+            pass
+
+    # Sets a newly linked node term's memop count and last access, as far as
+    # they're known.
+    def track(self, nod_trm: InPlaceNodeTerm):
+        loc = nod_trm.mem_loc
+        nod_trm.last_idx = self.loc_counts[loc] - 1
+        if self.memops is None:
+            nod_trm.last_access = self.last_access.get(loc, 0)
+        else:
+            nod_trm.last_access = UNKNOWN_ACCESS
+            self.terms[loc] = nod_trm
+
+# memops indexed at a time when linking catches up with the index, or in the
+# background; and the time per frame the viewer spends indexing in the
+# background, so it stays responsive
+INDEX_STEP = 256
+INDEX_SECS = 1 / 60
+
+# A read-only list of interactions that links each one the first time it's
+# indexed. Since linking is sequential, that also links everything before it.
+# Its length is the number of interactions indexed so far, which is always at
+# least one past the last one linked, until the whole log is indexed.
+class LazyItrs:
+    def __init__(self, table: MemOpTable, linker: Linker, index: ItrIndex):
+        self.table = table
+        self.linker = linker
+        self.index = index
+        # linking pairs the decoded table again, from scratch
+        self.memops: Optional[Iterator[MemOpBase]] = pair_redexes(self.rows(), linker.bag)
+        # table row of the last memop linked
+        self.row = -1
+
+    def __len__(self) -> int:
+        return len(self.index.offsets)
+
+    def __getitem__(self, idx: int) -> Interaction:
+        if idx < 0:
+            self.index.index_all()
+            idx += len(self)
+        self.index.index_to(idx)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        self.link(idx)
+        return self.linker.itrs[idx]
+
+    def __iter__(self) -> Iterator[Interaction]:
+        idx = 0
+        while idx < len(self):
+            yield self[idx]
+            idx += 1
+
+    # the table's rows, decoding and indexing more of the log whenever
+    # linking catches up with the index
+    def rows(self) -> Iterator[MemOp]:
+        table = self.table
+        row = 0
+        while True:
+            while row < len(table):
+                yield table[row]
+                row += 1
+            if not self.index.extend(INDEX_STEP) and row == len(table):
+                return
+
+    def link(self, idx: int):
+        itrs = self.linker.itrs
+        end = self.index.ends[idx]
+        while self.memops and (len(itrs) <= idx or self.row < end):
+            memop = next(self.memops, None)
+            if memop is None:
+                self.memops = None
+                break
+            self.linker.add(memop)
+            # paired redex pushes don't have a row; the memop after one does
+            if isinstance(memop, MemOp):
+                self.row = memop.idx
+
+    # indexes some more of the log; False once it's all indexed
+    def index_more(self) -> bool:
+        stop = time.monotonic() + INDEX_SECS
+        while self.index.extend(INDEX_STEP):
+            if time.monotonic() >= stop:
+                return True
+        return False
+
+def parse_file(filename: str, link: Callable[[], Model]) -> Optional[Model]:
     try:
-        with open(filename, 'r') as f:
-            return parse_memops(f.read())
+        return link()
     except FileNotFoundError:
-        print(f"Error: File '{filename}' not found.")
+        print(f"Error: File '{filename}' not found.", file=sys.stderr)
     except Exception as e:
-        print(f"Error parsing file: {e}")
+        print(f"Error parsing file: {e}", file=sys.stderr)
         traceback.print_exc()
 
-    return []
+    return None
 
 def sum_nodes(refs: list[ExpandRef]) -> int:
     return sum(len(a.nodes) for a in refs)
 
-def main(filename: str):
-    memops = parse_file(filename)
-    if not memops:
+def load_lazy_model(filename: str, workers: int = 1) -> Optional[Model]:
+    try:
+        table = MemOpTable()
+        bag = RedexBag()
+        if workers > 1:
+            # deferred; parallel imports this module
+            from parallel import decode
+            decode(filename, table, workers)
+            memops = pair_redexes(map(table.__getitem__, range(len(table))), bag)
+        else:
+            memops = iter_memops(filename, table, bag)
+        index = ItrIndex(memops, bag)
+        linker = Linker(table, RedexBag(), index)
+        itrs = LazyItrs(table, linker, index)
+        index.index_to(0)
+        if not itrs:
+            return None
+        # the root term is stored by the boot ref
+        itrs[0]
+    except FileNotFoundError:
+        print(f"Error: File '{filename}' not found.", file=sys.stderr)
+        return None
+    except Exception as e:
+        print(f"Error parsing file: {e}", file=sys.stderr)
+        traceback.print_exc()
+        return None
+
+    return Model(linker.root(), itrs, linker.refs, linker.redex_bldr.redexes,
+                 table, index.memop_count)
+
+def load_model(filename: str, workers: int = 1, use_cache: bool = True,
+               cache_dir: Optional[str] = None, lazy: bool = False) -> Optional[Model]:
+    if use_cache:
+        model = cache.load(filename, cache_dir)
+        if model:
+            return model
+
+    # a lazy model isn't fully linked, so it's never cached
+    if lazy:
+        return load_lazy_model(filename, workers)
+
+    if workers > 1:
+        # deferred; parallel imports this module
+        from parallel import link_parallel
+        model = parse_file(filename, lambda: link_parallel(filename, workers))
+    else:
+        table = MemOpTable()
+        bag = RedexBag()
+        memops = MemOpCounter(iter_memops(filename, table, bag))
+        model = parse_file(filename, lambda: Model(*make_all(memops, table, bag),
+                                                   table, memops.count))
+    if not model or not model.memop_count:
+        return None
+
+    if use_cache:
+        cache.save(filename, model, cache_dir)
+    return model
+
+def main(filename: str, workers: int = 1, use_cache: bool = True,
+         cache_dir: Optional[str] = None, lazy: bool = False, realtime: float = 0,
+         text_cache_mb: float = 16):
+    model = load_model(filename, workers, use_cache, cache_dir, lazy)
+    if not model:
         print(f"No memory operations loaded")
         sys.exit(1)
 
-    (root, itrs, refs, redexes) = make_all(memops)
+    (root, itrs, refs, redexes, _, memop_count) = model
 
-    print(f"memops {len(memops)} itrs {len(itrs)} refs {len(refs)} nodes {sum_nodes(refs)} redexes {len(redexes)}")
+    if isinstance(itrs, LazyItrs):
+        # refs, nodes and redexes aren't known until they're linked, nor the
+        # rest until they're indexed
+        print(f"memops {memop_count} itrs {len(itrs)} indexed so far")
+    else:
+        print(f"memops {memop_count} itrs {len(itrs)} refs {len(refs)} nodes {sum_nodes(refs)} redexes {len(redexes)}")
     if log: print(f"{[ref.def_idx for ref in refs]}")
     if log: print(f"ref.def_idx < 7 or >= 1024: {sum(1 for ref in refs if ref.def_idx < 7 or ref.def_idx >= DefIdx.MAT)}")
     if not root:
@@ -381,11 +866,31 @@ def main(filename: str):
     elif not itrs:
         print(f"No interactions found")
     else:
-        event_loop(root, itrs)
+        # deferred; the viewer needs pygame, the model doesn't
+        from vis import event_loop
+        # a lazy model isn't linked far enough to analyze up front; the
+        # viewer analyzes it as it goes
+        lazy = isinstance(itrs, LazyItrs)
+        liveness = None if lazy else analyze(root, itrs)
+        event_loop(root, itrs, realtime, int(text_cache_mb * (1 << 20)), liveness,
+                   itrs.index_more if lazy else None)
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print(f"usage: parse <filename>")
-        sys.exit(1)
-
-    main(sys.argv[1])
+    parser = argparse.ArgumentParser(prog='parse')
+    parser.add_argument('filename')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="parse and link the memlog with this many processes")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't read or write the parsed model cache")
+    parser.add_argument('--cache-dir',
+                        help="where to keep the parsed model cache (default: next to the memlog)")
+    parser.add_argument('--lazy', action='store_true',
+                        help="link interactions as they're reached instead of up front")
+    parser.add_argument('--realtime', type=float, default=0, metavar='RATE',
+                        help="replay at the pace of the memlog's timestamps, RATE timestamp units per second")
+    parser.add_argument('--text-cache-mb', type=float, default=16, metavar='MB',
+                        help="memory for rendered text, in megabytes (default: 16)")
+    args = parser.parse_args()
+
+    main(args.filename, args.jobs, not args.no_cache, args.cache_dir, args.lazy, args.realtime,
+         args.text_cache_mb)
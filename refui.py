@@ -1,3 +1,4 @@
+from bisect import bisect_left, bisect_right
 from dataclasses import dataclass
 from enum import IntEnum
 from typing import Tuple, Optional
@@ -9,25 +10,6 @@ from fonts import fonts
 from hvm import *
 from text_cache import TextCache
 
-def ref_name(def_idx: int):
-    d = {
-        0: "height",
-        1: "leaf",
-        2: "main",
-        3: "make",
-        4: "make_leaf",
-        5: "make_node",
-        6: "node",
-        7: "sum",
-        8: "sum_leaf",
-        9: "sum_node"
-    }
-    if def_idx > DefIdx.MAT:
-        def_idx -= DefIdx.MAT
-        return f"matu32_{def_idx}"
-    else:
-        return d.get(def_idx, f"ref_{def_idx}")
-
 class Metadata(IntEnum):
     NONE = 0,
     CNT  = 1,
@@ -45,6 +27,20 @@ class RefRect:
     selected: bool = False
     visible: bool = True
 
+    # The rect is drawn once into its own surface, and redrawn only when it's
+    # dirty: when it's (de)selected, when one of its node terms is set
+    # (ref.version), when metadata is toggled, or when the cursor passes the
+    # last access of one of its node terms, which changes its done color.
+    surface: Optional[pygame.Surface] = None
+    # where self.x, self.y is in surface
+    origin: Position = Position(0, 0)
+    dirty: bool = True
+    version: int = -1
+    show_md: Metadata = Metadata.NONE
+    # the surface is current for cursors in [cursor, next_done)
+    cursor: int = 0
+    next_done: int = 0
+
     def get_rect(self) -> pygame.Rect:
         return pygame.Rect(self.x, self.y, self.width, self.height)
 
@@ -60,27 +56,15 @@ class RefRect:
         term = nod_trm.term
         values = [
             f"{nod_trm.mem_loc:03d}",
-            term.tag[:3],
+            str(term.tag),
             f"{term.lab:03d}",
             f"{term.loc:03d}"
         ]
         table = md['table']
-        color = md['done_color'] if nod_trm.memops_done() else md['text_color']
+        color = md['done_color'] if nod_trm.done(md['cursor']) else md['text_color']
         x_off = 0
         for i, value in enumerate(values):
-            rndr_txt = md['text_cache'].get_rendered_text(value)
-            if self.selected or (self.color_scheme == "brt terminal"):
-                if not rndr_txt.brt.surface or rndr_txt.brt.color != color:
-                    rndr_txt.brt.surface = md['font'].render(value, True, color)
-                    rndr_txt.brt.color = color
-                val_surf = rndr_txt.brt.surface
-            else:
-                if not rndr_txt.dim.surface or rndr_txt.dim.color != color:
-                    rndr_txt.dim.surface = md['font'].render(value, True, color)
-                    rndr_txt.dim.color = color
-                val_surf = rndr_txt.dim.surface
-                    
-            surface.blit(val_surf, (pos.x + x_off, pos.y))
+            md['text_cache'].draw(surface, md['font'], value, (pos.x + x_off, pos.y), color)
             if nod_trm.empty: # draw memory loc only for empty terms
                 break
             x_off += table['column_widths'][i]
@@ -89,13 +73,12 @@ class RefRect:
 
     def draw_counts(self, nod_trm: InPlaceNodeTerm, surface: pygame.Surface, y: int, md: dict):
         stor_idx = nod_trm.memop_idx
-        stor_max = len(nod_trm.memops) - 1
+        stor_max = nod_trm.last_memop_idx()
         value = f"{stor_idx}/{stor_max}"
-        color = md['done_color'] if nod_trm.memops_done() else md['text_color']
-        val_surf = md['font'].render(value, True, color)
+        color = md['done_color'] if nod_trm.done(md['cursor']) else md['text_color']
         table = md['table']
-        x = self.x - (table['metrics']['char_width'] * 3 + table['metrics']['half_char']) + md['offset']
-        surface.blit(val_surf, (x, y))
+        x = self.x - counts_width(table) + md['offset']
+        md['text_cache'].draw(surface, md['font'], value, (x, y), color)
 
     """
     # TODO probably move to hvm.py
@@ -145,11 +128,10 @@ class RefRect:
     def draw_context(self, nod_trm: InPlaceNodeTerm, surface: pygame.Surface, y: int, md: dict):
         ctx = self.get_context(nod_trm)
         if not ctx: return
-        color = md['done_color'] if nod_trm.memops_done() else md['text_color']
-        ctx_surf = md['font'].render(ctx, True, color)
+        color = md['done_color'] if nod_trm.done(md['cursor']) else md['text_color']
         table = md['table']
         x = self.x + table['ref_width'] + table['metrics']['char_width'] + md['offset']
-        surface.blit(ctx_surf, (x, y))
+        md['text_cache'].draw(surface, md['font'], ctx, (x, y), color)
 
     def draw_metadata(self, nod_trm: InPlaceNodeTerm, surface: pygame.Surface, y: int, md: dict):
         show_md = md['show_md']
@@ -158,10 +140,55 @@ class RefRect:
         if show_md in (Metadata.CTX, Metadata.ALL):
             self.draw_context(nod_trm, surface, y, md)
 
+    def is_dirty(self, md: dict) -> bool:
+        return (self.dirty or self.version != self.ref.version or self.show_md != md['show_md'] or
+                not self.cursor <= md['cursor'] < self.next_done)
+
+    # where the surface is drawn on the screen
+    def screen_rect(self, offset: int) -> Optional[pygame.Rect]:
+        if not self.surface: return None
+        return self.surface.get_rect(topleft=(self.x + offset - self.origin.x, self.y - self.origin.y))
+
     def draw(self, surface: pygame.Surface, md: dict):
         if not self.visible: return
+        if self.is_dirty(md):
+            self.render(md)
+        surface.blit(self.surface, (self.x + md['offset'] - self.origin.x, self.y - self.origin.y))
 
-        if self.ref.memops_done():
+    def render(self, md: dict):
+        table = md['table']
+        cursor = md['cursor']
+        nod_trms = [nod_trm for node in self.ref.nodes for nod_trm in (node.neg, node.pos)]
+
+        # the title overhangs the top, counts are drawn left of the rect and
+        # contexts right of it
+        left = counts_width(table)
+        top = fonts.title.get_height() // 2
+        right = left
+        if md['show_md'] in (Metadata.CTX, Metadata.ALL):
+            ctxs = [ctx for nod_trm in nod_trms if (ctx := self.get_context(nod_trm))]
+            ctx_width = max((md['text_cache'].width(fonts.content, ctx, WHITE) for ctx in ctxs), default=0)
+            right = max(right, table['metrics']['char_width'] + ctx_width)
+        size = (left + self.width + right, top + self.height)
+        if not self.surface or self.surface.get_size() != size:
+            self.surface = pygame.Surface(size)
+            # text is antialiased against black, as it is on the screen
+            self.surface.set_colorkey(BLACK)
+        else:
+            self.surface.fill(BLACK)
+        self.origin = Position(left, top)
+
+        self.render_to(self.surface, {**md, 'offset': left - self.x}, self.y - top)
+        self.dirty = False
+        self.version = self.ref.version
+        self.show_md = md['show_md']
+        self.cursor = cursor
+        self.next_done = min((nod_trm.last_access for nod_trm in nod_trms
+                              if nod_trm.last_access > cursor), default=1 << 63)
+
+    # y0 is the y of surface's top
+    def render_to(self, surface: pygame.Surface, md: dict, y0: int):
+        if self.ref.done(md['cursor']):
             text_color = ORANGE
             done_color = ORANGE
             header_color = DIM_YELLOW
@@ -184,12 +211,13 @@ class RefRect:
         font = fonts.content
 
         table = md['table']
+        self_y = self.y - y0
 
         # Draw background
         #pygame.draw.rect(surface, BLACK, (self.x, self.y, self.width, self.height))
 
         # Draw border
-        rect = pygame.Rect(self.x + md['offset'], self.y, self.width, self.height)
+        rect = pygame.Rect(self.x + md['offset'], self_y, self.width, self.height)
         """
         if (rect.right + table['layout']['horz_spacing'] > table['layout']['section_width'] or
             rect.left < table['layout']['left_margin']):
@@ -198,14 +226,14 @@ class RefRect:
         pygame.draw.rect(surface, border_color, rect, table['border_thickness'])
 
         # Draw title with background to clip the border
-        title_surface = title_font.render(ref_name(self.ref.def_idx), True, header_color)
-        title_width = title_surface.get_width()
+        title = ref_name(self.ref.def_idx)
+        title_width = md['text_cache'].width(title_font, title, header_color)
         title_x = self.x + (self.width - title_width) // 2 + md['offset']
-        title_y = self.y - title_font.get_height() // 2
+        title_y = self_y - title_font.get_height() // 2
 
         title_bg_rect = pygame.Rect(title_x - 5, title_y, title_width + 10, title_font.get_height())
         pygame.draw.rect(surface, BLACK, title_bg_rect)
-        surface.blit(title_surface, (title_x, title_y))
+        md['text_cache'].draw(surface, title_font, title, (title_x, title_y), header_color)
 
         # Column headers
         headers = ["MEM", "TAG", "LAB", "LOC"]
@@ -214,8 +242,7 @@ class RefRect:
         header_y = title_bottom + table['row_spacing']['title_to_header']
 
         for i, header in enumerate(headers):
-            header_surface = font.render(header, True, header_color)
-            surface.blit(header_surface, (header_x, header_y))
+            md['text_cache'].draw(surface, font, header, (header_x, header_y), header_color)
             header_x += table['column_widths'][i]
             if i < len(headers) - 1:
                 header_x += table['col_spacing_by_index'][i + 1]
@@ -241,6 +268,9 @@ class RefRect:
                 self.draw_metadata(nod_trm, surface, y, md)
                 y += table['metrics']['line_height'] + table['row_spacing']['intra_row']
 
+def counts_width(table: dict) -> int:
+    return table['metrics']['char_width'] * 3 + table['metrics']['half_char']
+
 class RefManager:
     def __init__(self, screen: pygame.Surface, table: dict, text_cache: TextCache):
         self.screen = screen
@@ -251,6 +281,17 @@ class RefManager:
         self.ref_map: dict[int, RefRect] = {}
         self.show_deps_only: bool = False
         self.show_md: Metadata = Metadata.NONE
+        # access_key of the last memop executed, set by ItrManager
+        self.cursor = 0
+        # scroll offset the rects were last drawn at
+        self.offset = 0
+        # rects are laid out in columns; the x of each column and its rects,
+        # so only the columns on screen are visited
+        self.column_xs: list[int] = []
+        self.columns: list[list[RefRect]] = []
+        # how far any rect's surface reaches left and right of its x. a rect
+        # isn't rendered until it's on screen, so right is at least a column
+        self.reach: Tuple[int, int] = (0, table['layout']['scroll_width'])
 
     def get_ref_extents(self, ref: ExpandRef) -> Tuple[int, int]:
         width = self.table['ref_width']
@@ -267,6 +308,18 @@ class RefManager:
         self.all_rects.append(rect)
         self.disp_rects.append(rect)
         self.ref_map[rect.ref.id] = rect
+        if not self.column_xs or rect.x != self.column_xs[-1]:
+            assert not self.column_xs or rect.x > self.column_xs[-1]
+            self.column_xs.append(rect.x)
+            self.columns.append([])
+        self.columns[-1].append(rect)
+
+    # displayed rects in the columns that can be on screen at offset
+    def visible_rects(self, offset: int) -> list[RefRect]:
+        left, right = self.reach
+        lo = bisect_left(self.column_xs, -offset - right)
+        hi = bisect_right(self.column_xs, self.screen.get_width() - offset + left)
+        return [rect for column in self.columns[lo:hi] for rect in column]
 
     def add_ref(self, ref: ExpandRef, color_scheme: str = "dim terminal") -> RefRect:
         width, height = self.get_ref_extents(ref)
@@ -333,14 +386,34 @@ class RefManager:
             self.add_appref(app_ref, color_scheme)
     """
 
-    def draw_all(self):
-        md = {
+    def draw_md(self) -> dict:
+        return {
             'table' : self.table,
             'text_cache': self.text_cache,
             'show_md': self.show_md,
-            'offset': ui.scroll_mgr.offset
+            'offset': ui.scroll_mgr.offset,
+            'cursor': self.cursor
         }
-        for rect in self.disp_rects:
+
+    # re-render dirty rects before the frame is drawn, and mark where they
+    # were and are
+    def update(self):
+        md = self.draw_md()
+        if md['offset'] != self.offset:
+            ui.dirty.add(self.screen.get_rect())
+            self.offset = md['offset']
+        for rect in self.visible_rects(md['offset']):
+            if not rect.visible or not rect.is_dirty(md): continue
+            if (area := rect.screen_rect(md['offset'])):
+                ui.dirty.add(area)
+            rect.render(md)
+            ui.dirty.add(rect.screen_rect(md['offset']))
+            self.reach = (max(self.reach[0], rect.origin.x),
+                          max(self.reach[1], rect.surface.get_width() - rect.origin.x))
+
+    def draw_all(self):
+        md = self.draw_md()
+        for rect in self.visible_rects(md['offset']):
             rect.draw(self.screen, md)
 
     def get_selected(self) -> list[RefRect]:
@@ -357,10 +430,16 @@ class RefManager:
                 rect.visible = rect.ref.id in d
             else:
                 assert rect.visible
+        ui.dirty.add(self.screen.get_rect())
 
     def all_rects_visible(self):
         for rect in self.all_rects:
             rect.visible = True
+        ui.dirty.add(self.screen.get_rect())
+
+    def toggle_selected(self, rect: RefRect):
+        rect.selected = not rect.selected
+        rect.dirty = True
 
     def toggle_show_metadata(self):
         self.show_md += 1
@@ -392,7 +471,7 @@ class RefManager:
             # elif last_load.is_applam_itr():
             #     find the APPREF for this APPLAM. that's at the LAM's loc.
             #     loc = last_load.itr.redex.pos.loc
-            elif neg.tag == 'MAT':
+            elif neg.tag == Tag.MAT:
                 loc = neg.loc
                 #print(f"redex.neg MAT loc {neg.term} loc {loc}")
             else:
@@ -0,0 +1,70 @@
+import argparse
+import csv
+import json
+import sys
+from typing import Callable, Iterator, Optional, TextIO
+
+from hvm import Model
+from parse import load_model
+
+# What the command line tools that report on memlogs (stats, timeline, reuse,
+# defstats) share: loading each memlog, the output and model cache options,
+# and writing rows as CSV or JSON.
+
+FORMATS = ('csv', 'json')
+
+# The options every tool takes; filename is a single memlog, otherwise the
+# tool takes one or more.
+def make_parser(prog: str, fmt: str = 'csv', single: bool = False) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog=prog)
+    if single:
+        parser.add_argument('filename', metavar='memlog')
+    else:
+        parser.add_argument('filenames', nargs='+', metavar='memlog')
+    parser.add_argument('-f', '--format', choices=FORMATS, default=fmt)
+    parser.add_argument('-o', '--output', help="write to this file instead of stdout")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="parse and link the memlog with this many processes")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't read or write the parsed model cache")
+    parser.add_argument('--cache-dir',
+                        help="where to keep the parsed model cache (default: next to the memlog)")
+    return parser
+
+# Yields each memlog that loads with its model; the ones that don't are
+# reported and added to failed.
+def load_models(filenames: list[str], workers: int = 1, use_cache: bool = True,
+                cache_dir: Optional[str] = None,
+                failed: Optional[list[str]] = None) -> Iterator[tuple[str, Model]]:
+    for filename in filenames:
+        model = load_model(filename, workers, use_cache, cache_dir)
+        if not model:
+            print(f"Error: no memory operations loaded from '{filename}'", file=sys.stderr)
+            if failed is not None:
+                failed.append(filename)
+            continue
+        yield (filename, model)
+
+def write_csv(rows: list[dict], fields: tuple[str, ...], out: TextIO):
+    writer = csv.DictWriter(out, fields)
+    writer.writeheader()
+    writer.writerows(rows)
+
+# one line per row
+def write_json(rows: list[dict], out: TextIO):
+    for row in rows:
+        out.write(json.dumps(row) + '\n')
+
+# write is called with the output file, or stdout if there isn't one
+def write_output(write: Callable[[TextIO], None], output: Optional[str]):
+    if output:
+        with open(output, 'w', newline='') as out:
+            write(out)
+    else:
+        write(sys.stdout)
+
+def write_rows(rows: list[dict], fields: tuple[str, ...], fmt: str, output: Optional[str]):
+    if fmt == 'csv':
+        write_output(lambda out: write_csv(rows, fields, out), output)
+    else:
+        write_output(lambda out: write_json(rows, out), output)
@@ -0,0 +1,266 @@
+import sys
+from array import array
+from dataclasses import dataclass, field
+from typing import Optional
+
+from hvm import *
+from liveness import NOT_FREED, Liveness, analyze
+from report import load_models, make_parser, write_rows
+from timeline import make_timeline
+
+# Simulates how much node memory a reuse policy would save, by replaying a
+# model's node allocations and frees through an allocator.
+#
+# Each ExpandRef allocates one block of len(nodes) nodes, and its block is
+# freed once liveness has freed all of its nodes. The replay is in
+# interaction order, and the blocks freed at the start of an interaction are
+# freed before it allocates. Addresses and sizes are in nodes.
+#
+# Cost is a count of allocator operations: a bump, a free list push or pop,
+# each split or merge of a buddy block, and taking an empty arena.
+
+@dataclass(eq=False)
+class Allocs:
+    # per block
+    sizes: array = field(default_factory=lambda: array('I'))
+    tids: array = field(default_factory=lambda: array('I'))
+    # in replay order: block b's alloc is b and its free is ~b
+    order: array = field(default_factory=lambda: array('i'))
+    # the most nodes live at once, regardless of policy
+    peak_live: int = 0
+
+def make_allocs(model: Model, liveness: Optional[Liveness] = None) -> Allocs:
+    if not liveness:
+        liveness = analyze(model.root, model.itrs)
+    allocs = Allocs()
+    tid_column = model.table.tid
+    # blocks freed at the start of each interaction
+    frees: dict[int, list[int]] = {}
+    for itr in model.itrs:
+        for block in frees.pop(itr.idx, []):
+            allocs.order.append(~block)
+        if not isinstance(itr, ExpandRef) or not itr.nodes: continue
+
+        block = len(allocs.sizes)
+        allocs.sizes.append(len(itr.nodes))
+        # the thread that stored the nodes
+        allocs.tids.append(tid_column[itr.nodes[0].neg.memops.idxs[0]])
+        allocs.order.append(block)
+        free_itrs = [liveness.free_itr(node) for node in itr.nodes]
+        if NOT_FREED not in free_itrs:
+            frees.setdefault(max(free_itrs), []).append(block)
+    if model.itrs:
+        allocs.peak_live = make_timeline(model, liveness).peak_live[-1]
+    return allocs
+
+class Policy:
+    NAME = ''
+
+    def __init__(self):
+        # end of the heap, so also its peak footprint
+        self.top = 0
+        self.cost = 0
+        # allocations satisfied by reusing freed space
+        self.reused = 0
+
+    def bump(self, size: int) -> int:
+        addr = self.top
+        self.top += size
+        self.cost += 1
+        return addr
+
+    def alloc(self, size: int, tid: int) -> int:
+        return self.bump(size)
+
+    def free(self, addr: int, size: int, tid: int):
+        pass
+
+# never reuses anything, like HVM does today
+class BumpPolicy(Policy):
+    NAME = 'bump'
+
+# reuses a freed block only for an allocation of exactly its size
+class SizeClassPolicy(Policy):
+    NAME = 'size'
+
+    def __init__(self):
+        super().__init__()
+        self.free_lists: dict = {}
+
+    def key(self, size: int, tid: int):
+        return size
+
+    def alloc(self, size: int, tid: int) -> int:
+        free_list = self.free_lists.get(self.key(size, tid))
+        if not free_list:
+            return self.bump(size)
+        self.cost += 1
+        self.reused += 1
+        return free_list.pop()
+
+    def free(self, addr: int, size: int, tid: int):
+        self.free_lists.setdefault(self.key(size, tid), []).append(addr)
+        self.cost += 1
+
+@dataclass(eq=False)
+class Arena:
+    base: int
+    end: int
+    top: int
+    # the furthest top has been, so what below it has been used before
+    high: int
+    # blocks allocated from it that aren't freed yet
+    live: int = 0
+
+# Each thread bump allocates from an arena of its own, taken from a shared
+# heap. An arena is reset to empty once every block allocated from it has
+# been freed; the thread keeps bumping from it if it's the one it's using,
+# and otherwise keeps it to take again when it needs a new one. A block
+# larger than SIZE gets an arena of its own size.
+class ArenaPolicy(Policy):
+    NAME = 'arena'
+    SIZE = 64
+
+    def __init__(self):
+        super().__init__()
+        # the arena each thread is bumping from, and the empty ones it has
+        self.current: dict[int, Arena] = {}
+        self.empty: dict[int, list[Arena]] = {}
+        self.arenas: dict[int, Arena] = {}
+
+    def take_arena(self, size: int, tid: int) -> Arena:
+        empty = self.empty.get(tid, [])
+        for (i, arena) in enumerate(empty):
+            if arena.end - arena.base >= size:
+                self.cost += 1
+                return empty.pop(i)
+        size = max(size, self.SIZE)
+        base = self.bump(size)
+        return Arena(base, base + size, base, base)
+
+    def alloc(self, size: int, tid: int) -> int:
+        arena = self.current.get(tid)
+        if not arena or arena.top + size > arena.end:
+            if arena and not arena.live:
+                self.empty.setdefault(tid, []).append(arena)
+            arena = self.current[tid] = self.take_arena(size, tid)
+        addr = arena.top
+        if addr < arena.high:
+            self.reused += 1
+        arena.top += size
+        arena.high = max(arena.high, arena.top)
+        arena.live += 1
+        self.arenas[addr] = arena
+        self.cost += 1
+        return addr
+
+    def free(self, addr: int, size: int, tid: int):
+        arena = self.arenas.pop(addr)
+        arena.live -= 1
+        self.cost += 1
+        if arena.live: return
+        arena.top = arena.base
+        if self.current.get(tid) is not arena:
+            self.empty.setdefault(tid, []).append(arena)
+
+# Blocks are rounded up to a power of two. A larger free block is split to
+# satisfy an allocation, and a freed block merges with its buddy if that's
+# free too.
+class BuddyPolicy(Policy):
+    NAME = 'buddy'
+
+    def __init__(self):
+        super().__init__()
+        # free block addrs, by order
+        self.free_blocks: list[set[int]] = []
+
+    def add_free(self, addr: int, order: int):
+        while len(self.free_blocks) <= order:
+            self.free_blocks.append(set())
+        self.free_blocks[order].add(addr)
+
+    def alloc(self, size: int, tid: int) -> int:
+        order = (size - 1).bit_length()
+        for split in range(order, len(self.free_blocks)):
+            if not self.free_blocks[split]: continue
+            addr = self.free_blocks[split].pop()
+            self.cost += 1
+            self.reused += 1
+            while split > order:
+                split -= 1
+                self.add_free(addr + (1 << split), split)
+                self.cost += 1
+            return addr
+
+        # blocks are aligned to their size; the gap below one goes to the
+        # free lists as the largest aligned blocks that fit
+        block_size = 1 << order
+        while self.top & (block_size - 1):
+            gap_order = (self.top & -self.top).bit_length() - 1
+            self.add_free(self.top, gap_order)
+            self.top += 1 << gap_order
+        return self.bump(block_size)
+
+    def free(self, addr: int, size: int, tid: int):
+        order = (size - 1).bit_length()
+        self.cost += 1
+        while order < len(self.free_blocks):
+            buddy = addr ^ (1 << order)
+            if buddy not in self.free_blocks[order]: break
+            self.free_blocks[order].remove(buddy)
+            addr = min(addr, buddy)
+            order += 1
+            self.cost += 1
+        self.add_free(addr, order)
+
+POLICIES = {policy.NAME: policy for policy in (BumpPolicy, SizeClassPolicy, BuddyPolicy, ArenaPolicy)}
+
+def simulate(allocs: Allocs, policy: Policy) -> dict:
+    sizes = allocs.sizes
+    tids = allocs.tids
+    addrs = array('q', bytes(8 * len(sizes)))
+    for block in allocs.order:
+        if block >= 0:
+            addrs[block] = policy.alloc(sizes[block], tids[block])
+        else:
+            block = ~block
+            policy.free(addrs[block], sizes[block], tids[block])
+    count = len(sizes)
+    return {
+        'policy': policy.NAME,
+        'allocs': count,
+        'reused': policy.reused,
+        'peak_live': allocs.peak_live,
+        'peak_footprint': policy.top,
+        # the share of the footprint that's never live at once
+        'fragmentation': round(1 - allocs.peak_live / policy.top, 4) if policy.top else 0,
+        'cost': policy.cost,
+        'cost_per_alloc': round(policy.cost / count, 3) if count else 0
+    }
+
+FIELDS = ('memlog', 'policy', 'allocs', 'reused', 'peak_live', 'peak_footprint',
+          'fragmentation', 'cost', 'cost_per_alloc')
+
+def main(filenames: list[str], policies: list[str], fmt: str = 'csv',
+         output: Optional[str] = None, workers: int = 1, use_cache: bool = True,
+         cache_dir: Optional[str] = None) -> int:
+    results = []
+    failed = []
+    for (filename, model) in load_models(filenames, workers, use_cache, cache_dir, failed):
+        # the allocs are shared by every policy's replay
+        allocs = make_allocs(model)
+        for name in policies:
+            results.append({'memlog': filename, **simulate(allocs, POLICIES[name]())})
+
+    # JSON is one line per memlog and policy
+    write_rows(results, FIELDS, fmt, output)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    parser = make_parser('reuse')
+    parser.add_argument('-p', '--policy', action='append', choices=list(POLICIES),
+                        help="simulate this policy; may be repeated (default: all)")
+    args = parser.parse_args()
+
+    sys.exit(main(args.filenames, args.policy or list(POLICIES), args.format, args.output,
+                  args.jobs, not args.no_cache, args.cache_dir))
@@ -0,0 +1,237 @@
+import csv
+import sys
+from collections import Counter
+from typing import Iterator, Optional
+
+from hvm import *
+from liveness import FREED_REACHABLE, NOT_FREED, UNREACHABLE, Liveness, analyze
+from parse import sum_nodes
+from report import load_models, make_parser, write_json, write_output
+
+# Summary statistics of a memlog's model, for batch analysis of traces. This
+# only imports the model and parser, never pygame or the UI modules.
+#
+# Times are differences of the memlog's timestamp column, in its own units.
+#
+# Every section is a flat {key: value} dict so it maps directly onto CSV rows
+# of (memlog, stat, key, value). Histogram keys are the lower bound of
+# power-of-two buckets: 0, 1, 2, 4, 8, ...
+
+def bucket(value: int) -> int:
+    return 1 << (value.bit_length() - 1) if value > 0 else 0
+
+def histogram(values: Iterator[int]) -> dict[str, int]:
+    counts = Counter(bucket(value) for value in values)
+    return {str(key): counts[key] for key in sorted(counts)}
+
+# A node lives from the interaction that created it (its ref) to the last
+# interaction that accessed it, counted in interactions.
+def node_lifetime(model: Model, node: Node) -> int:
+    itr_column = model.table.itr
+    last = node.ref.idx
+    for node_term in (node.neg, node.pos):
+        for idx in node_term.memops.idxs:
+            last = max(last, itr_column[idx])
+    return last - node.ref.idx
+
+def node_lifetimes(model: Model) -> Iterator[int]:
+    for ref in model.refs:
+        for node in ref.nodes:
+            yield node_lifetime(model, node)
+
+# How long a node stays allocated, from the interaction that created it to
+# the one at whose start it's freed.
+def node_free_times(model: Model, liveness: Liveness) -> Iterator[int]:
+    for ref in model.refs:
+        for node in ref.nodes:
+            free_itr = liveness.free_itr(node)
+            if free_itr != NOT_FREED:
+                yield free_itr - ref.idx
+
+# A redex pushed by the boot ref has depth 0; any other redex is one deeper
+# than the redex of the interaction that pushed it.
+def redex_depths(model: Model) -> Iterator[int]:
+    depths: dict[int, int] = {}
+    # redexes are in push order, so a redex's parent always comes first
+    for redex in model.redexes:
+        parent = redex.psh_itr.redex if redex.psh_itr else None
+        depth = depths[id(parent)] + 1 if parent else 0
+        depths[id(redex)] = depth
+        yield depth
+
+# where reachability snapshots disagreed with refcounting, keyed by
+# "<itr>@<neg loc>" of the first snapshot that disagreed about each node
+def reach_mismatches(liveness: Liveness) -> dict[str, str]:
+    return {f"{m.itr_idx}@{m.loc}": m.kind for m in liveness.mismatches}
+
+# Each interaction's rows in the table, by index: its own memops, the pop of
+# its redex, the pushes of the redexes it made, and the stores of any nodes it
+# created. The parser doesn't make interactions of redexes without locs (like
+# ERA~REF), so their pops belong to none.
+def itr_rows(model: Model) -> list[list[int]]:
+    rows: list[list[int]] = [[] for _ in model.itrs]
+    for row, itr_idx in enumerate(model.table.itr):
+        if itr_idx >= 0:
+            rows[itr_idx].append(row)
+    for itr in model.itrs:
+        if isinstance(itr, HasNodes):
+            for node in itr.nodes:
+                rows[itr.idx] += (node.neg.memops.idxs[0], node.pos.memops.idxs[0])
+    return rows
+
+# Each interaction's first and last rows, and the first row of the next
+# interaction on the same thread, or -1 for a thread's last interaction
+def itr_spans(model: Model, rows: Optional[list[list[int]]] = None) -> Iterator[tuple[Interaction, int, int, int]]:
+    if rows is None:
+        rows = itr_rows(model)
+    tid_column = model.table.tid
+    spans = sorted((min(itr_rows), max(itr_rows), itr) for itr, itr_rows in zip(model.itrs, rows) if itr_rows)
+    # the previous span, by thread
+    prev: dict[int, tuple[int, int, Interaction]] = {}
+    for span in spans:
+        tid = tid_column[span[0]]
+        if tid in prev:
+            first, last, itr = prev[tid]
+            yield (itr, first, last, span[0])
+        prev[tid] = span
+    for first, last, itr in prev.values():
+        yield (itr, first, last, -1)
+
+# Each interaction's cost in log time, from its first row (the pop of its
+# redex) to the first row of the next interaction on the same thread. A
+# thread's last interaction costs the time to its own last row.
+def itr_times(model: Model, rows: Optional[list[list[int]]] = None) -> Iterator[tuple[Interaction, int]]:
+    ts_column = model.table.ts
+    for itr, first, last, next_first in itr_spans(model, rows):
+        yield (itr, ts_column[next_first if next_first >= 0 else last] - ts_column[first])
+
+# An interaction's latency is the log time from its first row, the pop of its
+# redex, to its last. The gap after it is the time from its last row to the
+# next interaction's pop on the same thread.
+def itr_latencies(model: Model, rows: Optional[list[list[int]]] = None) -> Iterator[tuple[Interaction, int, Optional[int]]]:
+    ts_column = model.table.ts
+    for itr, first, last, next_first in itr_spans(model, rows):
+        gap = ts_column[next_first] - ts_column[last] if next_first >= 0 else None
+        yield (itr, ts_column[last] - ts_column[first], gap)
+
+# nearest rank
+def percentile(values: list[int], pct: int) -> int:
+    return values[max(0, (len(values) * pct + 99) // 100 - 1)]
+
+def make_stats(filename: str, model: Model, reach_stride: int = 0) -> dict:
+    counts: Counter[str] = Counter()
+    memops: Counter[str] = Counter()
+    max_memops: dict[str, int] = {}
+    # memops by op, and EXCHs by whether they take, by interaction type. A
+    # redex's pop is logged as a pair of LOADs and its push as a pair of
+    # STORs, but they're counted as POPs and PUSHes.
+    ops: dict[Op, Counter[str]] = {op: Counter() for op in (Op.LOAD, Op.STOR, Op.EXCH, Op.POP, Op.PUSH)}
+    takes: Counter[str] = Counter()
+    rows = itr_rows(model)
+    op_column = model.table.op
+    for itr in model.itrs:
+        name = itr.name()
+        counts[name] += 1
+        count = len(rows[itr.idx])
+        memops[name] += count
+        max_memops[name] = max(max_memops.get(name, 0), count)
+        for memop in itr.memops:
+            ops[memop.op][name] += 1
+            if memop.is_take():
+                takes[name] += 1
+        nodes = len(itr.nodes) * 2 if isinstance(itr, HasNodes) else 0
+        ops[Op.STOR][name] += nodes
+        # the rest of its rows are pops and pushes
+        own = set(itr.memops.idxs)
+        for row in rows[itr.idx][:len(rows[itr.idx]) - nodes]:
+            if row in own: continue
+            ops[Op.POP if op_column[row] == Op.LOAD else Op.PUSH][name] += 1
+    times: Counter[str] = Counter()
+    for itr, time in itr_times(model, rows):
+        times[itr.name()] += time
+    latencies: dict[str, list[int]] = {}
+    gaps: list[int] = []
+    for itr, latency, gap in itr_latencies(model, rows):
+        latencies.setdefault(itr.name(), []).append(latency)
+        if gap is not None:
+            gaps.append(gap)
+    for values in latencies.values():
+        values.sort()
+
+    liveness = analyze(model.root, model.itrs, reach_stride)
+    names = sorted(counts)
+    stats = {
+        'memlog': filename,
+        'totals': {
+            'memops': model.memop_count,
+            'itrs': len(model.itrs),
+            'refs': len(model.refs),
+            'nodes': sum_nodes(model.refs),
+            'redexes': len(model.redexes),
+            'nodes_never_freed': liveness.node_free.count(NOT_FREED),
+            'log_time': model.table.ts[-1] - model.table.ts[0] if len(model.table) else 0,
+            'gap_time': sum(gaps)
+        },
+        'itr_count': {name: counts[name] for name in names},
+        'itr_memops': {name: memops[name] for name in names},
+        'itr_memops_mean': {name: round(memops[name] / counts[name], 3) for name in names},
+        'itr_memops_max': {name: max_memops[name] for name in names},
+        'itr_loads': {name: ops[Op.LOAD][name] for name in names},
+        'itr_stors': {name: ops[Op.STOR][name] for name in names},
+        'itr_exchs': {name: ops[Op.EXCH][name] for name in names},
+        'itr_pops': {name: ops[Op.POP][name] for name in names},
+        'itr_pushes': {name: ops[Op.PUSH][name] for name in names},
+        # the rest of the EXCHs swap
+        'itr_take_ratio': {name: round(takes[name] / ops[Op.EXCH][name], 3)
+                           for name in names if ops[Op.EXCH][name]},
+        'itr_time': {name: times[name] for name in names},
+        'itr_time_mean': {name: round(times[name] / counts[name], 3) for name in names},
+        'itr_latency_p50': {name: percentile(latencies[name], 50) for name in names if name in latencies},
+        'itr_latency_p90': {name: percentile(latencies[name], 90) for name in names if name in latencies},
+        'itr_latency_max': {name: latencies[name][-1] for name in names if name in latencies},
+        'itr_latency': histogram(latency for values in latencies.values() for latency in values),
+        'itr_gap': histogram(gaps),
+        'node_lifetime': histogram(node_lifetimes(model)),
+        'node_free_after': histogram(node_free_times(model, liveness)),
+        'redex_depth': histogram(redex_depths(model))
+    }
+    if reach_stride:
+        kinds = Counter(m.kind for m in liveness.mismatches)
+        stats['reach'] = {
+            'stride': reach_stride,
+            'snapshots': liveness.snapshots,
+            UNREACHABLE: kinds[UNREACHABLE],
+            FREED_REACHABLE: kinds[FREED_REACHABLE]
+        }
+        stats['reach_mismatch'] = reach_mismatches(liveness)
+    return stats
+
+def write_csv(all_stats: list[dict], out):
+    writer = csv.writer(out)
+    writer.writerow(('memlog', 'stat', 'key', 'value'))
+    for stats in all_stats:
+        for stat, section in stats.items():
+            if stat == 'memlog': continue
+            for key, value in section.items():
+                writer.writerow((stats['memlog'], stat, key, value))
+
+def main(filenames: list[str], fmt: str = 'json', output: Optional[str] = None,
+         workers: int = 1, use_cache: bool = True, cache_dir: Optional[str] = None,
+         reach_stride: int = 0) -> int:
+    failed = []
+    all_stats = [make_stats(filename, model, reach_stride) for (filename, model)
+                 in load_models(filenames, workers, use_cache, cache_dir, failed)]
+
+    # JSON is one line per memlog
+    write = write_csv if fmt == 'csv' else write_json
+    write_output(lambda out: write(all_stats, out), output)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    parser = make_parser('stats', 'json')
+    parser.add_argument('--reach-stride', type=int, default=0, metavar='N',
+                        help="cross-check refcounting against reachability every N interactions")
+    args = parser.parse_args()
+
+    sys.exit(main(args.filenames, args.format, args.output, args.jobs,
+                  not args.no_cache, args.cache_dir, args.reach_stride))
@@ -1,32 +1,60 @@
-from dataclasses import dataclass, field
-from typing import Optional
+from collections import OrderedDict
 
 import pygame
 
 from commonui import Color
 
-@dataclass(eq=False)
-class RenderedSurface:
-    surface: Optional[pygame.Surface] = None
-    color: Optional[Color] = None
-
-@dataclass(eq=False)
-class RenderedText:
-    text: str
-    dim: RenderedSurface = field(default_factory=RenderedSurface)
-    brt: RenderedSurface = field(default_factory=RenderedSurface)
+# Rendered strings, keyed by (text, color, font), least recently used first.
+# They're evicted once their surfaces take more than budget bytes.
+DEFAULT_BUDGET = 16 << 20
 
 class TextCache:
-    def __init__(self):
-        self._cache: dict[str, RenderedText] = {}
-    
-    def get_rendered_text(self, text: str) -> RenderedText:
-        if text not in self._cache:
-            self._cache[text] = RenderedText(text)
-        return self._cache[text]
-    
+    def __init__(self, budget: int = DEFAULT_BUDGET):
+        self.budget = budget
+        self._cache: OrderedDict[tuple[str, Color, int], pygame.Surface] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, font: pygame.font.Font, text: str, color: Color) -> pygame.Surface:
+        key = (text, color, id(font))
+        surface = self._cache.get(key)
+        if surface:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = self._cache[key] = font.render(text, True, color)
+        self.bytes += surface_bytes(surface)
+        # always keep the newest, even if it alone is over budget
+        while self.bytes > self.budget and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last=False)
+            self.bytes -= surface_bytes(evicted)
+            self.evictions += 1
+        return surface
+
+    # returns the width drawn
+    def draw(self, surface: pygame.Surface, font: pygame.font.Font, text: str,
+             pos: tuple[int, int], color: Color) -> int:
+        text_surface = self.get(font, text, color)
+        surface.blit(text_surface, pos)
+        return text_surface.get_width()
+
+    def width(self, font: pygame.font.Font, text: str, color: Color) -> int:
+        return self.get(font, text, color).get_width()
+
     def clear(self):
         self._cache.clear()
-    
+        self.bytes = 0
+
     def size(self) -> int:
         return len(self._cache)
+
+    def stats(self) -> str:
+        return (f"Text cache: {self.hits} hits {self.misses} misses {self.evictions} evicted "
+                f"{self.bytes >> 10}K")
+
+def surface_bytes(surface: pygame.Surface) -> int:
+    return surface.get_pitch() * surface.get_height()
@@ -0,0 +1,194 @@
+import csv
+import json
+import struct
+import sys
+import zlib
+from array import array
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+from hvm import *
+from liveness import NOT_FREED, Liveness, analyze
+from report import load_models, make_parser, write_output
+
+# Node memory use over time, for sizing node memory. Row i is the state after
+# interaction i has executed, including the nodes freed as a result, which
+# liveness frees at the start of interaction i + 1.
+#
+# Node memory is bump allocated and a freed node's space is never reused, so
+# freed is also the number of nodes freed but not reused, and allocated is the
+# high water mark of node memory.
+
+COLUMNS = ('itr', 'allocated', 'live', 'freed', 'peak_live')
+
+@dataclass(eq=False)
+class Timeline:
+    allocated: array = field(default_factory=lambda: array('I'))
+    live: array = field(default_factory=lambda: array('I'))
+    freed: array = field(default_factory=lambda: array('I'))
+    peak_live: array = field(default_factory=lambda: array('I'))
+
+    def __len__(self) -> int:
+        return len(self.allocated)
+
+    def rows(self) -> Iterator[tuple[int, int, int, int, int]]:
+        for idx in range(len(self)):
+            yield (idx, self.allocated[idx], self.live[idx], self.freed[idx], self.peak_live[idx])
+
+def make_timeline(model: Model, liveness: Optional[Liveness] = None) -> Timeline:
+    if not liveness:
+        liveness = analyze(model.root, model.itrs)
+    # nodes freed at the start of each interaction, and after the last one
+    freed_at = array('I', bytes(4 * (len(model.itrs) + 1)))
+    for free_itr in liveness.node_free:
+        if free_itr != NOT_FREED:
+            freed_at[free_itr] += 1
+
+    timeline = Timeline()
+    allocated = freed = peak_live = 0
+    for itr in model.itrs:
+        if isinstance(itr, ExpandRef):
+            allocated += len(itr.nodes)
+        freed += freed_at[itr.idx + 1]
+        live = allocated - freed
+        peak_live = max(peak_live, live)
+        timeline.allocated.append(allocated)
+        timeline.live.append(live)
+        timeline.freed.append(freed)
+        timeline.peak_live.append(peak_live)
+    return timeline
+
+def write_csv(timeline: Timeline, out):
+    writer = csv.writer(out)
+    writer.writerow(COLUMNS)
+    writer.writerows(timeline.rows())
+
+# one object of columns
+def write_json(filename: str, timeline: Timeline, out):
+    columns = {'memlog': filename, 'itr': list(range(len(timeline)))}
+    for name in COLUMNS[1:]:
+        columns[name] = getattr(timeline, name).tolist()
+    out.write(json.dumps(columns) + '\n')
+
+# Plots are area charts of allocated and live nodes (so the band between them
+# is freed space), with a line at the peak live set. There's no matplotlib
+# dependency; SVG is written as text and PNG with zlib.
+
+PLOT_WIDTH = 640
+PLOT_HEIGHT = 240
+PLOT_BG = (255, 255, 255)
+PLOT_COLORS = {
+    'allocated': (200, 200, 200),
+    'live': (70, 130, 180),
+    'peak_live': (200, 60, 60)
+}
+
+# The max value in each of width columns; interactions are spread across the
+# columns, or repeated when there are fewer interactions than columns.
+def plot_columns(values: array, width: int) -> list[int]:
+    count = len(values)
+    columns = []
+    for x in range(width):
+        lo = x * count // width
+        hi = max(lo + 1, (x + 1) * count // width)
+        columns.append(max(values[lo:hi]))
+    return columns
+
+# bar heights in pixels, per column, of each plotted series
+def plot_heights(timeline: Timeline, width: int, height: int) -> dict[str, list[int]]:
+    # no interactions, no bars
+    if not timeline:
+        return {'allocated': [], 'live': [], 'peak_live': [0]}
+    top = max(timeline.allocated[-1], 1)
+    heights = {}
+    for name in ('allocated', 'live'):
+        heights[name] = [value * height // top for value in plot_columns(getattr(timeline, name), width)]
+    heights['peak_live'] = [timeline.peak_live[-1] * height // top]
+    return heights
+
+def rgb(color: tuple[int, int, int]) -> str:
+    return '#%02x%02x%02x' % color
+
+def write_svg(path: str, timeline: Timeline, width: int = PLOT_WIDTH, height: int = PLOT_HEIGHT):
+    heights = plot_heights(timeline, width, height)
+    lines = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">',
+        f'<rect width="{width}" height="{height}" fill="{rgb(PLOT_BG)}"/>'
+    ]
+    for name in ('allocated', 'live'):
+        points = [f"0,{height}"]
+        for x, h in enumerate(heights[name]):
+            points.append(f"{x},{height - h} {x + 1},{height - h}")
+        points.append(f"{width},{height}")
+        lines.append(f'<polygon points="{" ".join(points)}" fill="{rgb(PLOT_COLORS[name])}"/>')
+    y = height - heights['peak_live'][0]
+    peak_color = rgb(PLOT_COLORS['peak_live'])
+    lines.append(f'<line x1="0" y1="{y}" x2="{width}" y2="{y}" stroke="{peak_color}" stroke-dasharray="4"/>')
+    (peak_live, allocated) = (timeline.peak_live[-1], timeline.allocated[-1]) if timeline else (0, 0)
+    lines.append(f'<text x="4" y="{max(y - 4, 12)}" font-size="12" fill="{peak_color}">'
+                 f'peak live {peak_live} of {allocated} nodes</text>')
+    lines.append('</svg>')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+def png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+def write_png(path: str, timeline: Timeline, width: int = PLOT_WIDTH, height: int = PLOT_HEIGHT):
+    heights = plot_heights(timeline, width, height)
+    pixels = bytearray(bytes(PLOT_BG) * (width * height))
+
+    def fill(x: int, y: int, color: tuple[int, int, int]):
+        offset = (y * width + x) * 3
+        pixels[offset:offset + 3] = bytes(color)
+
+    for name in ('allocated', 'live'):
+        for x, h in enumerate(heights[name]):
+            for y in range(height - h, height):
+                fill(x, y, PLOT_COLORS[name])
+    y = min(height - heights['peak_live'][0], height - 1)
+    for x in range(0, width, 2):
+        fill(x, y, PLOT_COLORS['peak_live'])
+
+    # each row starts with filter type 0 (none)
+    stride = width * 3
+    raw = b''.join(b'\0' + pixels[y * stride:(y + 1) * stride] for y in range(height))
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(png_chunk(b'IDAT', zlib.compress(raw)))
+        f.write(png_chunk(b'IEND', b''))
+
+def main(filename: str, fmt: str = 'csv', output: Optional[str] = None,
+         plot: Optional[str] = None, workers: int = 1, use_cache: bool = True,
+         cache_dir: Optional[str] = None) -> int:
+    loaded = list(load_models([filename], workers, use_cache, cache_dir))
+    if not loaded:
+        return 1
+    (_, model) = loaded[0]
+    timeline = make_timeline(model)
+
+    def write(out):
+        if fmt == 'csv':
+            write_csv(timeline, out)
+        else:
+            write_json(filename, timeline, out)
+
+    write_output(write, output)
+    if plot:
+        if plot.endswith('.png'):
+            write_png(plot, timeline)
+        else:
+            write_svg(plot, timeline)
+    return 0
+
+if __name__ == "__main__":
+    parser = make_parser('timeline', single=True)
+    parser.add_argument('--plot', metavar='FILE',
+                        help="also plot the timeline to this .svg or .png file")
+    args = parser.parse_args()
+    if args.plot and not args.plot.endswith(('.svg', '.png')):
+        parser.error("--plot must be a .svg or .png file")
+
+    sys.exit(main(args.filename, args.format, args.output, args.plot, args.jobs,
+                  not args.no_cache, args.cache_dir))
@@ -1,5 +1,7 @@
 import time
+from dataclasses import dataclass
 from types import SimpleNamespace
+from typing import Callable, Optional
 
 import pygame
 
@@ -7,10 +9,11 @@ from commonui import *
 from fonts import fonts, get_font_metrics
 from freeui import FreeManager
 from hvm import Interaction, Term
+from liveness import Analysis, Liveness
 from refui import RefManager
-from itrui import ItrManager
+from itrui import ItrManager, RealtimeReplay
 from anim import AnimManager
-from text_cache import TextCache
+from text_cache import DEFAULT_BUDGET, TextCache
 
 def get_table_metrics() -> dict:
     metrics = get_font_metrics(fonts.content)
@@ -103,21 +106,54 @@ def get_table_metrics() -> dict:
         'free': free_layout,
     }
 
-def draw_instructions(screen: pygame.Surface, table: dict):
+# Event loop state that isn't layout: the number of frames drawn, and the key
+# help, with the text cache counters, as it was last laid out
+@dataclass(eq=False)
+class LoopState:
+    frames: int = 0
+    text_cache_stats: str = ''
+    text_cache_time: float = 0
+    # frame the counters were last drawn in
+    text_cache_frame: int = -1
+    instructions: Optional[list[str]] = None
+    instructions_rect: Optional[pygame.Rect] = None
+
+def get_instructions(table: dict, state: LoopState) -> list[str]:
     if not 'speed' in table: table['speed'] = 1
-    instructions = [
+    return [
         "SPACE: Execute next        ←/→: Scroll",
         f"Click: Toggle select       +/-: Speed({table['speed']})",
         #"D:     Toggle dependencies",
-        "M:     Toggle metadata"
+        "M:     Toggle metadata",
         #,f"+/-:   Speed({table['speed']})"
+        state.text_cache_stats
     ]
+
+# the text cache counters change whenever anything is drawn, so they're
+# refreshed at most once a second, and only if frames other than the one that
+# draws them were drawn since
+def update_instructions(table: dict, state: LoopState, text_cache: TextCache, now: float):
+    if now - state.text_cache_time >= 1 and state.frames > state.text_cache_frame:
+        state.text_cache_stats = text_cache.stats()
+        state.text_cache_time = now
+        state.text_cache_frame = state.frames + 1
+    instructions = get_instructions(table, state)
+    if instructions == state.instructions: return
+    if state.instructions_rect:
+        ui.dirty.add(state.instructions_rect)
+    line_height = table['metrics']['line_height'] + table['row_spacing']['intra_row']
+    width = max(text_cache.width(fonts.content, instruction, WHITE) for instruction in instructions)
+    state.instructions = instructions
+    state.instructions_rect = pygame.Rect(10, 10, width, line_height * len(instructions))
+    ui.dirty.add(state.instructions_rect)
+
+def draw_instructions(screen: pygame.Surface, table: dict, state: LoopState,
+                      text_cache: TextCache):
     y = 0
     color = WHITE
     line_height = table['metrics']['line_height'] + table['row_spacing']['intra_row']
-    for i, instruction in enumerate(instructions):
-        text = fonts.content.render(instruction, True, color)
-        screen.blit(text, (10, 10 + y))
+    for i, instruction in enumerate(state.instructions):
+        text_cache.draw(screen, fonts.content, instruction, (10, 10 + y), color)
         y += line_height
 
 def add_speed(amt: int, table: dict):
@@ -127,6 +163,8 @@ def add_speed(amt: int, table: dict):
 def event_handler(event, md: dict):
     if event.type == pygame.QUIT:
         return False
+    elif event.type == pygame.VIDEOEXPOSE:
+        ui.dirty.add(pygame.display.get_surface().get_rect())
     elif event.type == pygame.KEYDOWN:
         if event.key == pygame.K_SPACE:
             md.itr_mgr.next()
@@ -147,10 +185,16 @@ def event_handler(event, md: dict):
     elif event.type == pygame.MOUSEBUTTONDOWN:
         rect = md.ref_mgr.rect_at_position(*event.pos)
         if rect:
-            rect.selected = not rect.selected
+            md.ref_mgr.toggle_selected(rect)
     return True
 
-def event_loop(root: Term, itrs: list[Interaction]):
+# realtime is the number of log time units to replay per second, if the
+# memlog should be replayed at the pace of its timestamps. text_cache_budget
+# is in bytes. index_more, for a lazy model, indexes some more of its log;
+# it's called once a frame until it returns False.
+def event_loop(root: Term, itrs: list[Interaction], realtime: float = 0,
+               text_cache_budget: int = DEFAULT_BUDGET, liveness: Optional[Liveness] = None,
+               index_more: Optional[Callable[[], bool]] = None):
     pygame.display.init()
 
     table = get_table_metrics()
@@ -158,11 +202,15 @@ def event_loop(root: Term, itrs: list[Interaction]):
     pygame.display.set_caption("HVM3 Node Visualizer")
     clock = pygame.time.Clock()
 
-    text_cache = TextCache()
+    text_cache = TextCache(text_cache_budget)
+    state = LoopState()
 
     ref_mgr = RefManager(screen, table, text_cache)
     anim_mgr = AnimManager(screen, ref_mgr, table, text_cache)
-    free_mgr = FreeManager(screen, ref_mgr, table)
+    # a lazy model's liveness is analyzed as its interactions are reached
+    analysis = None if liveness else Analysis(root)
+    free_mgr = FreeManager(screen, table, text_cache,
+                           liveness if liveness else analysis.liveness, analysis)
     itr_mgr = ItrManager(screen, itrs, ref_mgr, anim_mgr, free_mgr, table, text_cache)
 
     md = SimpleNamespace(
@@ -172,10 +220,11 @@ def event_loop(root: Term, itrs: list[Interaction]):
         table = table
     )
 
-    free_mgr.boot(root)
     itr_mgr.on_itr(itrs[0])
+    replay = RealtimeReplay(itr_mgr, realtime) if realtime else None
 
     pygame.key.set_repeat(500, 50)
+    ui.dirty.add(screen.get_rect())
 
     running = True
     while running:
@@ -190,18 +239,36 @@ def event_loop(root: Term, itrs: list[Interaction]):
             if not event_handler(event, md): #ref_mgr, itr_mgr, anim_mgr, table):
                 running = False
 
-        screen.fill(BLACK)
+        # SPACE steps instead of the replay, so it's still one step a frame
+        if replay and not space:
+            replay.update(current_time)
 
-        draw_instructions(screen, table)
+        if index_more and not index_more():
+            index_more = None
 
         ui.scroll_mgr.update(table)
-        ref_mgr.draw_all()
         anim_mgr.update_all(current_time)
-        anim_mgr.draw_all()
-        free_mgr.draw()
-        itr_mgr.draw()
+        ref_mgr.update()
+        itr_mgr.update()
+        update_instructions(table, state, text_cache, current_time)
+
+        # redraw within the bounds of what changed, and update only what
+        # changed; if nothing did, skip the frame
+        dirty = ui.dirty.take()
+        if dirty:
+            screen.set_clip(dirty[0].unionall(dirty[1:]))
+            screen.fill(BLACK)
+
+            draw_instructions(screen, table, state, text_cache)
+
+            ref_mgr.draw_all()
+            anim_mgr.draw_all()
+            free_mgr.draw()
+            itr_mgr.draw()
 
-        pygame.display.flip()
+            screen.set_clip(None)
+            pygame.display.update(dirty)
+            state.frames += 1
 
         clock.tick(30)
 